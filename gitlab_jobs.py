@@ -4,21 +4,85 @@ Show GitLab pipeline job durations.
 """
 
 import argparse
+import collections
 import csv
+import datetime
+import heapq
+import hmac
+import http.server
+import itertools
 import json
+import math
+import os
+import random
+import re
 import subprocess
+import sys
+import time
 from collections import defaultdict
-from statistics import mean, median, stdev
-from typing import Iterable, Optional
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from statistics import StatisticsError, correlation, mean, median, stdev
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
+from urllib.parse import quote, urlparse
 
 import colorama
 import gitlab
+import requests
+import requests.adapters
 
 
 __version__ = '1.3.0.dev0'
 
 
+FINISHED_STATUSES = {'success', 'failed', 'canceled', 'skipped'}
+
+# GitLab job logs mark collapsible sections with lines like
+# \e[0Ksection_start:1560896352:step_script\r\e[0KExecuting "step_script"
+# \e[0Ksection_end:1560896353:step_script\r\e[0K
+# where the section name may be followed by options like [collapsed=true].
+SECTION_RX = re.compile(
+    rb'section_(start|end):(\d+):([^\s\[\x1b]+)(?=[\s\[\x1b])')
+MAX_SECTION_MARKER_LEN = 256
+CHUNK_SIZE = 64 * 1024
+
+HTTP_POOL_SIZE = 16
+
+SIGNIFICANCE_LEVEL = 0.05
+
+# runner time spent on these job attempts didn't produce a green pipeline
+WASTED_OUTCOMES = ('failed', 'canceled', 'retried')
+
+# artifact types that later jobs download (the rest are reports for GitLab)
+DOWNLOADED_ARTIFACTS = ('archive', 'metadata')
+# smallest average size of unused artifacts worth pointing out, in bytes
+LARGE_ARTIFACTS = 1024 * 1024
+# smallest artifact growth worth pointing out, and how many jobs to list
+ARTIFACT_GROWTH = 0.2
+MAX_ARTIFACT_GROWTH_SHOWN = 5
+
+# pipeline events list every job, so they can get big, but not this big
+MAX_WEBHOOK_PAYLOAD = 16 * 1024 * 1024
+
+WEBHOOK_EVENTS = {
+    # object_kind: X-Gitlab-Event
+    'pipeline': 'Pipeline Hook',
+    'build': 'Job Hook',
+}
+
+
 def get_project_name_from_git_url() -> Optional[str]:
     try:
         url = subprocess.check_output(['git', 'remote', 'get-url', 'origin'],
@@ -37,16 +101,33 @@ def get_project_name_from_git_url() -> Optional[str]:
     return name
 
 
-def get_pipelines(
-    project: 'gitlab.v4.objects.Project',
-    args: argparse.Namespace,
-) -> Iterable['gitlab.v4.objects.ProjectPipeline']:
+def get_pipeline_filter_args(args: argparse.Namespace) -> Dict[str, Any]:
     filter_args = {
         'ref': args.branch
     }
     if not args.all_pipelines:
         filter_args['scope'] = 'finished'
         filter_args['status'] = 'success'
+    if args.since:
+        filter_args['updated_after'] = args.since
+    if args.until:
+        filter_args['updated_before'] = args.until
+    return filter_args
+
+
+class TimeLimitReached(Exception):
+    """The --max-time budget ran out."""
+
+
+def out_of_time(args: argparse.Namespace) -> bool:
+    return args.deadline is not None and time.monotonic() >= args.deadline
+
+
+def get_pipelines(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+) -> Iterable['gitlab.v4.objects.ProjectPipeline']:
+    filter_args = get_pipeline_filter_args(args)
 
     max_per_page = 100
     pages = (args.limit + max_per_page - 1) // max_per_page
@@ -61,6 +142,134 @@ def get_pipelines(
             yield pipeline
 
 
+def get_new_pipelines(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+    known_ids: Set[int],
+    watermark: Optional[str],
+) -> List['gitlab.v4.objects.ProjectPipeline']:
+    """Fetch all the pipelines that are not in known_ids yet, newest first.
+
+    Pipelines can finish out of order, so we go through them by the time of
+    their last update, until we reach one that was last updated before the
+    watermark saved by the previous run.  Pipelines we already know about
+    can be updated again (e.g. by a manual job), so we skip them instead of
+    stopping there.  Pipelines older than all the known ones are out of
+    scope.
+
+    Without a watermark we have to go through the whole list.
+    """
+    listing = project.pipelines.list(
+        iterator=True, per_page=100, order_by='updated_at', sort='desc',
+        **get_pipeline_filter_args(args))
+    oldest_id = min(known_ids, default=0)
+    stop = parse_timestamp(watermark) if watermark else None
+    new_pipelines = []
+    for pipeline in listing:
+        if stop is not None and parse_timestamp(pipeline.updated_at) < stop:
+            break
+        if out_of_time(args):
+            raise TimeLimitReached()
+        if pipeline.id in known_ids or pipeline.id < oldest_id:
+            continue
+        new_pipelines.append(pipeline)
+    return sorted(new_pipelines, key=lambda pipeline: pipeline.id,
+                  reverse=True)
+
+
+def even_sample_indices(total: int, n: int) -> List[int]:
+    if n >= total:
+        return list(range(total))
+    if n == 1:
+        return [(total - 1) // 2]
+    return [round(i * (total - 1) / (n - 1)) for i in range(n)]
+
+
+def stratified_sample_indices(
+    pipelines: List['gitlab.v4.objects.ProjectPipeline'],
+    n: int,
+) -> List[int]:
+    """Pick about n pipelines spread evenly within each week.
+
+    The number of pipelines picked from each week is proportional to the
+    number of pipelines in that week.
+    """
+    weeks = defaultdict(list)  # type: Dict[Tuple[int, int], List[int]]
+    for i, pipeline in enumerate(pipelines):
+        date = datetime.date.fromisoformat(pipeline.created_at[:10])
+        weeks[date.isocalendar()[:2]].append(i)
+    # largest remainder method, so the total adds up to n
+    quotas = {
+        week: n * len(indices) / len(pipelines)
+        for week, indices in weeks.items()
+    }
+    counts = {week: math.floor(quota) for week, quota in quotas.items()}
+    by_remainder = sorted(quotas, key=lambda week: counts[week] - quotas[week])
+    for week in by_remainder[:n - sum(counts.values())]:
+        counts[week] += 1
+    return sorted(
+        indices[i]
+        for week, indices in weeks.items()
+        for i in even_sample_indices(len(indices), counts[week])
+    )
+
+
+def sample_pipelines(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+) -> Tuple[List['gitlab.v4.objects.ProjectPipeline'], int]:
+    """Pick args.sample pipelines spread across the selected date range.
+
+    Returns the sampled pipelines (newest first) and the total number of
+    pipelines they were sampled from.
+    """
+    filter_args = get_pipeline_filter_args(args)
+    per_page = 100
+    listing = project.pipelines.list(iterator=True, per_page=per_page,
+                                     **filter_args)
+    if listing.total is None or args.sample_by == 'week':
+        # GitLab doesn't count the pipelines when there are more than 10,000
+        # of them, so we have to page through the whole list
+        everything = []
+        for pipeline in listing:
+            if out_of_time(args):
+                raise TimeLimitReached()
+            everything.append(pipeline)
+        if args.sample_by == 'week':
+            indices = stratified_sample_indices(everything, args.sample)
+        else:
+            indices = even_sample_indices(len(everything), args.sample)
+        return [everything[i] for i in indices], len(everything)
+
+    # fetch only the pages that contain the pipelines we want
+    pages = {1: list(itertools.islice(listing, per_page))}
+    sample = []
+    for i in even_sample_indices(listing.total, args.sample):
+        page = i // per_page + 1
+        if page not in pages:
+            if out_of_time(args):
+                raise TimeLimitReached()
+            pages[page] = project.pipelines.list(
+                page=page, per_page=per_page, **filter_args)
+        if i % per_page < len(pages[page]):
+            sample.append(pages[page][i % per_page])
+    return sample, listing.total
+
+
+def confidence_interval(values: List[float], population: int) -> float:
+    """Compute the half-width of the 95% confidence interval of the mean.
+
+    ``values`` is a random sample out of ``population`` values.
+    """
+    n = len(values)
+    if n >= population:
+        return 0.0
+    if n < 2:
+        return math.inf
+    fpc = math.sqrt((population - n) / (population - 1))
+    return 1.96 * stdev(values) / math.sqrt(n) * fpc
+
+
 def get_jobs(pipeline, args):
     filter_args = {}
     if not args.all_pipelines:
@@ -68,6 +277,1098 @@ def get_jobs(pipeline, args):
     return pipeline.jobs.list(all=True, **filter_args)
 
 
+def get_job_attempts(pipeline) -> list:
+    """Return all jobs of a pipeline, including retried attempts."""
+    return pipeline.jobs.list(all=True, include_retried=True)
+
+
+def split_retried(jobs: list) -> Tuple[list, list]:
+    """Split job attempts into the latest ones and the retried ones.
+
+    Only the attempt with the highest ID of each job counts; earlier
+    attempts of a job with the same name were retried.
+    """
+    latest = {}  # type: Dict[str, Any]
+    for job in jobs:
+        if job.name not in latest or job.id > latest[job.name].id:
+            latest[job.name] = job
+    latest_ids = {job.id for job in latest.values()}
+    return (
+        [job for job in jobs if job.id in latest_ids],
+        [job for job in jobs if job.id not in latest_ids],
+    )
+
+
+def select_jobs(jobs: list, args: argparse.Namespace) -> list:
+    """Pick the jobs get_jobs() would return from a list of all attempts."""
+    jobs, retried = split_retried(jobs)
+    if not args.all_pipelines:
+        jobs = [job for job in jobs if job.status == 'success']
+    return jobs
+
+
+RunnerTime = Dict[str, Dict[str, float]]
+
+
+def add_runner_time(
+    by_job: RunnerTime,
+    by_stage: RunnerTime,
+    attempts: list,
+) -> None:
+    """Add up runner seconds spent on job attempts by job name and stage."""
+    latest, retried = split_retried(attempts)
+    retried_ids = {job.id for job in retried}
+    for job in attempts:
+        if job.duration is None:
+            # never ran
+            continue
+        outcome = 'retried' if job.id in retried_ids else job.status
+        by_job[job.name][outcome] += job.duration
+        by_stage[job.stage][outcome] += job.duration
+
+
+def artifact_size(job, file_types: Optional[Iterable[str]] = None) -> int:
+    """Add up the sizes of a job's artifacts, except for the job log.
+
+    With ``file_types``, only artifacts of those types are counted.
+    """
+    return sum(
+        artifact['size'] or 0 for artifact in job.artifacts
+        if artifact['file_type'] != 'trace'
+        and (file_types is None or artifact['file_type'] in file_types)
+    )
+
+
+def last_stage(jobs: list) -> Optional[str]:
+    """Guess the last stage of a pipeline from its jobs.
+
+    The API doesn't tell us the order of stages, but GitLab creates all
+    jobs of a pipeline stage by stage, so job IDs go up with every stage.
+    """
+    first_ids = {}  # type: Dict[str, int]
+    for job in jobs:
+        first_ids[job.stage] = min(job.id, first_ids.get(job.stage, job.id))
+    if not first_ids:
+        return None
+    return max(first_ids, key=first_ids.__getitem__)
+
+
+def half_means(values: List[float]) -> Optional[Tuple[float, float]]:
+    """Average the older and the newer half of values.
+
+    Values are ordered newest first, like pipelines.
+    """
+    if len(values) < 2:
+        return None
+    half = len(values) // 2
+    return mean(values[-half:]), mean(values[:half])
+
+
+def growth(values: List[float]) -> Optional[float]:
+    """Relative change between the older and the newer half of values."""
+    means = half_means(values)
+    if means is None or not means[0]:
+        return None
+    older, newer = means
+    return (newer - older) / older
+
+
+def duration_correlation(sizes: List[Tuple[int, float]]) -> Optional[float]:
+    """Pearson's correlation between artifact sizes and job durations."""
+    try:
+        return correlation([size for size, duration in sizes],
+                           [duration for size, duration in sizes])
+    except StatisticsError:
+        # fewer than two values, or one of them never changes
+        return None
+
+
+def collect_durations(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+) -> Tuple[List[float], Dict[str, List[float]]]:
+    pipeline_durations = []
+    job_durations = defaultdict(list)  # type: Dict[str, List[float]]
+    for pipeline in get_pipelines(project, args):
+        if out_of_time(args):
+            break
+        pipeline = project.pipelines.get(pipeline.id)
+        if pipeline.duration is not None:
+            pipeline_durations.append(pipeline.duration)
+        for job in get_jobs(pipeline, args):
+            if job.duration is not None:
+                job_durations[job.name].append(job.duration)
+    return pipeline_durations, job_durations
+
+
+def mann_whitney_u(xs: List[float], ys: List[float]) -> float:
+    """Compute the two-sided p-value of the Mann-Whitney U test.
+
+    Uses the normal approximation with tie and continuity corrections.
+    """
+    n1, n2 = len(xs), len(ys)
+    n = n1 + n2
+    values = sorted([(x, 0) for x in xs] + [(y, 1) for y in ys])
+    rank_sum = 0.0
+    tie_term = 0
+    i = 0
+    while i < n:
+        j = i
+        while j < n and values[j][0] == values[i][0]:
+            j += 1
+        # tied values get the average of ranks i+1 .. j
+        rank = (i + 1 + j) / 2
+        rank_sum += rank * sum(1 for v in values[i:j] if v[1] == 0)
+        tie_term += (j - i) ** 3 - (j - i)
+        i = j
+    u = rank_sum - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = max(abs(u - n1 * n2 / 2) - 0.5, 0) / math.sqrt(variance)
+    return math.erfc(z / math.sqrt(2))
+
+
+def holm_bonferroni(p_values: List[float]) -> List[float]:
+    """Adjust p-values for multiple comparisons with the Holm method.
+
+    Returns the adjusted p-values in the same order.  Comparing them with
+    the significance level keeps the chance of any false positive among all
+    the comparisons under it.
+    """
+    m = len(p_values)
+    adjusted = [1.0] * m
+    running_max = 0.0
+    for rank, i in enumerate(sorted(range(m), key=lambda i: p_values[i])):
+        running_max = max(running_max, min(1.0, (m - rank) * p_values[i]))
+        adjusted[i] = running_max
+    return adjusted
+
+
+def compare_refs(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+) -> None:
+    ref_a, ref_b = args.compare
+    pipelines = 'pipelines' if args.all_pipelines else 'successful pipelines'
+    print("Comparing last {n} {pipelines} of {project} {a} and {b}:".format(
+        n=args.limit, pipelines=pipelines, project=project.name,
+        a=ref_a, b=ref_b))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = pool.map(
+            lambda ref: collect_durations(
+                project, argparse.Namespace(**dict(vars(args), branch=ref))),
+            [ref_a, ref_b])
+        (overall_a, jobs_a), (overall_b, jobs_b) = results
+    if out_of_time(args):
+        print("\nTime limit reached, comparing only the pipelines fetched"
+              " so far ({a} and {b}).".format(
+                  a=len(overall_a), b=len(overall_b)))
+
+    to_show = [
+        (job_name, jobs_a.get(job_name), jobs_b.get(job_name))
+        for job_name in sorted(set(jobs_a) | set(jobs_b))
+    ] + [('overall', overall_a, overall_b)]
+    maxlen = max(len(name) for name, a, b in to_show)
+    # with many jobs some would look significantly different by chance alone
+    p_values = holm_bonferroni([
+        mann_whitney_u(durations_a, durations_b)
+        for job_name, durations_a, durations_b in to_show
+        if durations_a and durations_b
+    ])
+    digits = 4.1
+    unit = "m", 60.0
+    print()
+    for job_name, durations_a, durations_b in to_show:
+        if not durations_a and not durations_b:
+            continue
+        if not durations_a or not durations_b:
+            print("  {name:{maxlen}}  only in {ref}".format(
+                name=job_name, maxlen=maxlen,
+                ref=ref_a if durations_a else ref_b))
+            continue
+        median_a = median(durations_a)
+        median_b = median(durations_b)
+        p = p_values.pop(0)
+        verdict = ''
+        if p < SIGNIFICANCE_LEVEL:
+            if median_b > median_a:
+                verdict = ' - ' + colorama.Fore.RED + 'slower'
+            else:
+                verdict = ' - ' + colorama.Fore.GREEN + 'faster'
+            verdict += colorama.Style.RESET_ALL
+        print(
+            "  {name:{maxlen}} "
+            " median {a:{digits}f}{unit} vs {b:{digits}f}{unit},"
+            " diff {diff:+{digits}f}{unit},"
+            " adjusted p={p:.3f}{verdict}"
+            .format(
+                name=job_name,
+                maxlen=maxlen,
+                digits=digits,
+                unit=unit[0],
+                a=median_a / unit[1],
+                b=median_b / unit[1],
+                # round first, or a tiny negative diff would show as -0.0
+                diff=round((median_b - median_a) / unit[1], 1) + 0.0,
+                p=p,
+                verdict=verdict,
+            )
+        )
+
+
+def read_csv(filename: str) -> Dict[str, List[str]]:
+    rows = {}  # type: Dict[str, List[str]]
+    try:
+        with open(filename, newline='') as f:
+            for row in csv.reader(f):
+                if row:
+                    rows[row[0]] = row[1:]
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+def write_csv(filename: str, rows: Dict[str, list]) -> None:
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for job_name, durations in sorted(rows.items()):
+            if job_name != 'overall':
+                writer.writerow([job_name] + list(durations))
+        if 'overall' in rows:
+            writer.writerow(['overall'] + list(rows['overall']))
+
+
+def get_csv_index_filename(filename: str) -> str:
+    return filename + '.pipelines'
+
+
+def read_csv_index(filename: str) -> List[int]:
+    # The side-car index lists the IDs of the pipelines already covered by
+    # the CSV file, newest first, one per line, after a header line with the
+    # watermark (see read_csv_watermark()).
+    try:
+        with open(get_csv_index_filename(filename)) as f:
+            return [
+                int(line) for line in f
+                if line.strip() and not line.startswith('#')
+            ]
+    except FileNotFoundError:
+        return []
+
+
+def read_csv_watermark(filename: str) -> Optional[str]:
+    # The watermark is the latest updated_at timestamp of the pipelines seen
+    # by the previous run; anything updated before it is already covered.
+    try:
+        with open(get_csv_index_filename(filename)) as f:
+            for line in f:
+                if line.startswith('# updated_at '):
+                    return line[len('# updated_at '):].strip()
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def latest_timestamp(timestamps: Iterable[Optional[str]]) -> Optional[str]:
+    return max(filter(None, timestamps), key=parse_timestamp, default=None)
+
+
+def append_csv(
+    filename: str,
+    job_durations: Dict[str, list],
+    pipeline_ids: List[int],
+    watermark: Optional[str] = None,
+) -> None:
+    rows = read_csv(filename)  # type: Dict[str, list]
+    for job_name, durations in job_durations.items():
+        # both old and new durations are listed newest first
+        rows[job_name] = list(durations) + rows.get(job_name, [])
+    write_csv(filename, rows)
+    known_ids = read_csv_index(filename)
+    with open(get_csv_index_filename(filename), 'w') as f:
+        if watermark:
+            f.write('# updated_at {}\n'.format(watermark))
+        for pipeline_id in pipeline_ids + known_ids:
+            f.write('{}\n'.format(pipeline_id))
+
+
+def get_cache_dir(args: argparse.Namespace) -> str:
+    if args.cache_dir:
+        return args.cache_dir
+    cache_home = (
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'gitlab-jobs')
+
+
+def iter_trace(
+    project: 'gitlab.v4.objects.Project',
+    job: 'gitlab.v4.objects.ProjectPipelineJob',
+    cache_dir: str,
+) -> Iterator[bytes]:
+    filename = os.path.join(
+        cache_dir, 'traces', str(project.id), '{}.log'.format(job.id))
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+        return
+    # lazy=True avoids an extra HTTP GET for job metadata we already have
+    # streamed=True, or requests reads the whole log into memory first
+    chunks = project.jobs.get(job.id, lazy=True).trace(
+        streamed=True, iterator=True, chunk_size=CHUNK_SIZE)
+    if job.status not in FINISHED_STATUSES:
+        # the log of a running job is incomplete, so don't cache it
+        yield from chunks
+        return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+    os.replace(filename + '.tmp', filename)
+
+
+def parse_sections(chunks: Iterable[bytes]) -> Dict[str, float]:
+    """Compute durations of job log sections.
+
+    Processes the log one chunk at a time, keeping only a short tail of the
+    previous chunk, in case a section marker straddles a chunk boundary.
+
+    Returns a dict mapping section names to their durations in seconds.
+    """
+    started = {}  # type: Dict[bytes, int]
+    sections = {}  # type: Dict[str, float]
+    tail = b''
+    for chunk in chunks:
+        buf = tail + chunk
+        end = 0
+        for m in SECTION_RX.finditer(buf):
+            kind, timestamp, name = m.group(1), int(m.group(2)), m.group(3)
+            if kind == b'start':
+                started[name] = timestamp
+            elif name in started:
+                section = name.decode('UTF-8', 'replace')
+                sections[section] = (
+                    sections.get(section, 0) + timestamp - started.pop(name))
+            end = m.end()
+        tail = buf[max(end, len(buf) - MAX_SECTION_MARKER_LEN):]
+    return sections
+
+
+def get_section_durations(
+    project: 'gitlab.v4.objects.Project',
+    jobs: List['gitlab.v4.objects.ProjectPipelineJob'],
+    args: argparse.Namespace,
+) -> Tuple[Dict[str, Dict[str, List[float]]], int]:
+    """Download and parse job logs.
+
+    Returns section durations by job name and section, and the number of
+    job logs skipped because the --max-time budget ran out.
+    """
+    cache_dir = get_cache_dir(args)
+    section_durations = defaultdict(
+        lambda: defaultdict(list)
+    )  # type: Dict[str, Dict[str, List[float]]]
+
+    def get_sections(
+        job: 'gitlab.v4.objects.ProjectPipelineJob',
+    ) -> Optional[Dict[str, float]]:
+        if out_of_time(args):
+            return None
+        return parse_sections(iter_trace(project, job, cache_dir))
+
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for job, sections in zip(jobs, pool.map(get_sections, jobs)):
+            if sections is None:
+                skipped += 1
+                continue
+            for section, duration in sections.items():
+                section_durations[job.name][section].append(duration)
+    return section_durations, skipped
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = math.floor(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def normalize_timestamp(timestamp: Optional[str]) -> Optional[str]:
+    # webhook payloads use '2016-08-12 15:23:28 UTC' instead of the ISO 8601
+    # timestamps returned by the REST API
+    if timestamp and timestamp.endswith(' UTC'):
+        return timestamp[:-len(' UTC')].replace(' ', 'T') + 'Z'
+    return timestamp
+
+
+def job_record_from_webhook(build: dict) -> dict:
+    artifacts = []
+    artifacts_file = build.get('artifacts_file') or {}
+    if artifacts_file.get('size'):
+        artifacts.append(dict(
+            file_type='archive',
+            size=artifacts_file['size'],
+            filename=artifacts_file['filename'],
+            file_format='zip',
+        ))
+    return dict(
+        id=build['id'],
+        name=build['name'],
+        stage=build['stage'],
+        status=build['status'],
+        created_at=normalize_timestamp(build.get('created_at')),
+        started_at=normalize_timestamp(build.get('started_at')),
+        finished_at=normalize_timestamp(build.get('finished_at')),
+        duration=build.get('duration'),
+        runner=build.get('runner'),
+        artifacts=artifacts,
+    )
+
+
+def record_from_webhook(event: Optional[str], payload: dict) -> Optional[dict]:
+    """Convert a GitLab webhook payload into a store record.
+
+    Returns None for events that should not be stored, e.g. events of
+    pipelines or jobs that have not finished yet.
+    """
+    if event == 'Pipeline Hook':
+        attrs = payload['object_attributes']
+        if attrs['status'] not in FINISHED_STATUSES:
+            return None
+        user = payload.get('user') or {}
+        return dict(
+            kind='pipeline',
+            project_id=payload['project']['id'],
+            project=payload['project']['path_with_namespace'],
+            project_name=payload['project']['name'],
+            id=attrs['id'],
+            ref=attrs['ref'],
+            sha=attrs['sha'],
+            status=attrs['status'],
+            created_at=normalize_timestamp(attrs['created_at']),
+            finished_at=normalize_timestamp(attrs.get('finished_at')),
+            duration=attrs.get('duration'),
+            user=dict(name=user.get('name'), username=user.get('username')),
+            jobs=[
+                job_record_from_webhook(build)
+                for build in payload.get('builds', [])
+            ],
+        )
+    if event == 'Job Hook':
+        if payload['build_status'] not in FINISHED_STATUSES:
+            return None
+        return dict(
+            job_record_from_webhook(dict(
+                id=payload['build_id'],
+                name=payload['build_name'],
+                stage=payload['build_stage'],
+                status=payload['build_status'],
+                created_at=payload.get('build_created_at'),
+                started_at=payload.get('build_started_at'),
+                finished_at=payload.get('build_finished_at'),
+                duration=payload.get('build_duration'),
+                runner=payload.get('runner'),
+            )),
+            kind='job',
+            project_id=payload['project_id'],
+            pipeline_id=payload['pipeline_id'],
+        )
+    return None
+
+
+def record_from_api(
+    project: 'gitlab.v4.objects.Project',
+    pipeline: 'gitlab.v4.objects.ProjectPipeline',
+    jobs: List['gitlab.v4.objects.ProjectPipelineJob'],
+) -> dict:
+    """Convert pipeline and job data from the GitLab API into a store record.
+    """
+    user = pipeline.user or {}
+    return dict(
+        kind='pipeline',
+        project_id=project.id,
+        project=project.path_with_namespace,
+        project_name=project.name,
+        id=pipeline.id,
+        ref=pipeline.ref,
+        sha=pipeline.sha,
+        status=pipeline.status,
+        created_at=pipeline.created_at,
+        finished_at=pipeline.finished_at,
+        duration=pipeline.duration,
+        user=dict(name=user.get('name'), username=user.get('username')),
+        jobs=[
+            dict(
+                id=job.id,
+                name=job.name,
+                stage=job.stage,
+                status=job.status,
+                created_at=job.created_at,
+                started_at=job.started_at,
+                finished_at=job.finished_at,
+                duration=job.duration,
+                runner=job.runner,
+                artifacts=job.artifacts,
+                # webhooks don't tell us job tags
+                tag_list=getattr(job, 'tag_list', []),
+            )
+            for job in sorted(jobs, key=lambda job: job.id)
+        ],
+    )
+
+
+def write_jsonl(filename: str, records: List[dict]) -> None:
+    # write a new file and rename it over the old one, so that graph.py
+    # --follow sees a new file instead of a rewrite under its feet
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    os.replace(tmp_filename, filename)
+
+
+class Store:
+    """Local store of finished pipelines and jobs.
+
+    This is a JSONL file with one pipeline or job record per line.  Records
+    are only ever appended; a later record for the same pipeline or job
+    replaces an earlier one.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+
+    def append(self, record: dict) -> None:
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def load(self) -> List[dict]:
+        """Load all pipelines, newest first.
+
+        Job records are merged into the jobs lists of their pipelines.
+        """
+        pipelines = {}  # type: Dict[int, dict]
+        jobs = defaultdict(dict)  # type: Dict[int, Dict[int, dict]]
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record['kind'] == 'pipeline':
+                        pipelines[record['id']] = record
+                        for job in record['jobs']:
+                            jobs[record['id']][job['id']] = job
+                    elif record['kind'] == 'job':
+                        jobs[record['pipeline_id']][record['id']] = record
+        except FileNotFoundError:
+            pass
+        result = []
+        for pipeline_id, pipeline in sorted(pipelines.items(), reverse=True):
+            pipeline = dict(pipeline, jobs=[
+                job for job_id, job in sorted(jobs[pipeline_id].items())
+            ])
+            result.append(pipeline)
+        return result
+
+
+class StoredObject:
+    """Read-only stand-in for a python-gitlab REST object."""
+
+    def __init__(self, attributes: dict) -> None:
+        self.attributes = attributes
+
+    def __getattr__(self, name: str):
+        try:
+            return self.attributes[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class StoredJobManager:
+
+    def __init__(self, jobs: List[dict]) -> None:
+        self._jobs = jobs
+
+    def list(self, all: bool = False, scope: Optional[str] = None,
+             **kwargs) -> List[StoredObject]:
+        return [
+            StoredObject(job) for job in self._jobs
+            if scope is None or job['status'] == scope
+        ]
+
+
+class StoredPipeline(StoredObject):
+
+    @property
+    def updated_at(self) -> str:
+        # all pipelines in the store are finished
+        return self.attributes['finished_at']
+
+    @property
+    def jobs(self) -> StoredJobManager:
+        return StoredJobManager(self.attributes['jobs'])
+
+
+class StoredPipelineList(list):
+    """Stand-in for python-gitlab's RESTObjectList."""
+
+    @property
+    def total(self) -> int:
+        return len(self)
+
+
+class StoredPipelineManager:
+
+    def __init__(self, pipelines: List[dict]) -> None:
+        self._pipelines = pipelines
+        self._by_id = {pipeline['id']: pipeline for pipeline in pipelines}
+
+    def list(self, page: int = 1, per_page: int = 20,
+             ref: Optional[str] = None, status: Optional[str] = None,
+             updated_after: Optional[str] = None,
+             updated_before: Optional[str] = None,
+             order_by: str = 'id', sort: str = 'desc',
+             iterator: bool = False,
+             **kwargs) -> List[StoredPipeline]:
+        # all pipelines in the store are finished, so we can ignore
+        # scope='finished', and their finished_at is also their updated_at
+        pipelines = [
+            StoredPipeline(pipeline) for pipeline in self._pipelines
+            if (ref is None or pipeline['ref'] == ref)
+            and (status is None or pipeline['status'] == status)
+            and (updated_after is None
+                 or pipeline['finished_at'] >= updated_after)
+            and (updated_before is None
+                 or pipeline['finished_at'] <= updated_before)
+        ]
+        if order_by == 'updated_at':
+            pipelines.sort(key=lambda pipeline: pipeline.updated_at,
+                           reverse=(sort == 'desc'))
+        if iterator:
+            return StoredPipelineList(pipelines)
+        # NB: like the GitLab API we assume all pages have the same size
+        start = (page - 1) * per_page
+        return pipelines[start:start + per_page]
+
+    def get(self, id: int) -> StoredPipeline:
+        return StoredPipeline(self._by_id[id])
+
+
+class StoredProject:
+    """Read-only stand-in for a python-gitlab Project backed by a Store."""
+
+    def __init__(self, store: Store, project: Optional[str] = None) -> None:
+        pipelines = [
+            pipeline for pipeline in store.load()
+            if project is None
+            or project in (pipeline['project'], str(pipeline['project_id']))
+        ]
+        if pipelines:
+            self.id = pipelines[0]['project_id']
+            self.name = pipelines[0]['project_name']
+            self.path_with_namespace = pipelines[0]['project']
+        else:
+            self.id = None
+            self.name = self.path_with_namespace = project or store.filename
+        self.pipelines = StoredPipelineManager(pipelines)
+
+
+class Record:
+    """Compact read-only stand-in for a python-gitlab REST object.
+
+    Keeps only the attributes we use, in slots instead of a dict.
+    """
+
+    __slots__ = ()
+    fields = ()  # type: Tuple[str, ...]
+
+    def __init__(self, data: dict) -> None:
+        for name in self.fields:
+            setattr(self, name, data.get(name))
+
+    @property
+    def attributes(self) -> dict:
+        return {name: getattr(self, name) for name in self.fields}
+
+
+class JobRecord(Record):
+    fields = (
+        'id', 'name', 'stage', 'status', 'created_at', 'started_at',
+        'finished_at', 'duration', 'runner', 'artifacts', 'tag_list',
+    )
+    __slots__ = fields
+
+    # like sys.intern(), but for runners: there are few of them, and each
+    # one is repeated in many jobs
+    _runners = {}  # type: Dict[int, dict]
+
+    def __init__(self, data: dict) -> None:
+        # there are many more jobs than pipelines, so we set every field
+        # exactly once here instead of going through Record.__init__()
+        self.id = data['id']
+        # these repeat a lot across jobs
+        self.name = sys.intern(data['name'])
+        self.stage = sys.intern(data['stage'])
+        self.status = sys.intern(data['status'])
+        self.created_at = data.get('created_at')
+        self.started_at = data.get('started_at')
+        self.finished_at = data.get('finished_at')
+        self.duration = data.get('duration')
+        runner = data.get('runner')
+        if runner and runner['id'] not in self._runners:
+            self._runners[runner['id']] = dict(
+                id=runner['id'], description=runner['description'])
+        self.runner = self._runners[runner['id']] if runner else runner
+        self.artifacts = [
+            dict(file_type=artifact['file_type'], size=artifact['size'],
+                 filename=artifact['filename'])
+            for artifact in data.get('artifacts') or ()
+        ]
+        self.tag_list = data.get('tag_list')
+
+
+class PipelineRecord(Record):
+    fields = (
+        'id', 'ref', 'sha', 'status', 'created_at', 'updated_at',
+        'finished_at', 'duration', 'user',
+    )
+    __slots__ = fields + ('jobs',)
+
+    def __init__(self, data: dict, jobs: 'FastPipelineJobManager') -> None:
+        super().__init__(data)
+        user = data.get('user')
+        if user:
+            self.user = dict(name=user['name'], username=user['username'])
+        self.jobs = jobs
+
+
+class FastList:
+    """Lazy list of records, like python-gitlab's RESTObjectList."""
+
+    def __init__(self, items: 'gitlab.GitlabList', record) -> None:
+        self._items = items
+        self._record = record
+
+    @property
+    def total(self) -> Optional[int]:
+        return self._items.total
+
+    def __iter__(self) -> 'FastList':
+        return self
+
+    def __next__(self) -> Record:
+        return self._record(next(self._items))
+
+
+class FastPipelineJobManager:
+    __slots__ = ('_gl', '_path')
+
+    def __init__(self, gl: gitlab.Gitlab, path: str) -> None:
+        self._gl = gl
+        self._path = path
+
+    def list(self, all: bool = False, **kwargs) -> List[JobRecord]:
+        return [
+            JobRecord(data)
+            for data in self._gl.http_list(self._path, kwargs, get_all=all)
+        ]
+
+
+class FastPipelineManager:
+
+    def __init__(self, gl: gitlab.Gitlab, project_id: int) -> None:
+        self._gl = gl
+        self._path = '/projects/{}/pipelines'.format(project_id)
+
+    def _record(self, data: dict) -> PipelineRecord:
+        return PipelineRecord(data, FastPipelineJobManager(
+            self._gl, '{}/{}/jobs'.format(self._path, data['id'])))
+
+    def list(self, iterator: bool = False, **kwargs):
+        if iterator:
+            items = self._gl.http_list(self._path, kwargs, iterator=True)
+            return FastList(cast(gitlab.GitlabList, items), self._record)
+        return [
+            self._record(data)
+            for data in self._gl.http_list(self._path, kwargs, get_all=False)
+        ]
+
+    def get(self, id: int) -> PipelineRecord:
+        data = self._gl.http_get('{}/{}'.format(self._path, id))
+        return self._record(cast(dict, data))
+
+
+class FastJob:
+
+    def __init__(self, gl: gitlab.Gitlab, path: str) -> None:
+        self._gl = gl
+        self._path = path
+
+    def trace(self, streamed: bool = False, iterator: bool = False,
+              chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        response = self._gl.http_get(self._path + '/trace', streamed=True,
+                                     raw=True)
+        return cast(requests.Response, response).iter_content(chunk_size)
+
+
+class FastJobManager:
+
+    def __init__(self, gl: gitlab.Gitlab, project_id: int) -> None:
+        self._gl = gl
+        self._path = '/projects/{}/jobs'.format(project_id)
+
+    def get(self, id: int, lazy: bool = False) -> FastJob:
+        return FastJob(self._gl, '{}/{}'.format(self._path, id))
+
+
+class FastProject:
+    """Lightweight stand-in for a python-gitlab Project.
+
+    Talks to the GitLab API through python-gitlab's HTTP session (which
+    pools connections and asks for gzip-compressed responses), but skips
+    building python-gitlab REST objects for every pipeline and job,
+    keeping only the fields we use in compact records instead.
+    """
+
+    def __init__(self, gl: gitlab.Gitlab, project: str) -> None:
+        data = cast(dict, gl.http_get(
+            '/projects/' + quote(str(project), safe='')))
+        self.id = data['id']
+        self.name = data['name']
+        self.path_with_namespace = data['path_with_namespace']
+        self.pipelines = FastPipelineManager(gl, self.id)
+        self.jobs = FastJobManager(gl, self.id)
+
+
+class WebhookServer(http.server.HTTPServer):
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        store: Store,
+        secret_token: str,
+        verbose: bool = False,
+    ) -> None:
+        super().__init__(address, WebhookHandler)
+        self.store = store
+        self.secret_token = secret_token
+        self.verbose = verbose
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+
+    server: WebhookServer
+
+    def do_POST(self) -> None:
+        token = self.headers.get('X-Gitlab-Token', '')
+        if not hmac.compare_digest(token.encode(),
+                                   self.server.secret_token.encode()):
+            self.send_error(401, 'Invalid X-Gitlab-Token')
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+            if length > MAX_WEBHOOK_PAYLOAD:
+                self.send_error(413, 'Webhook payload too large')
+                return
+            payload = json.loads(self.rfile.read(length))
+            record = record_from_webhook(
+                self.headers.get('X-Gitlab-Event'), payload)
+        except (ValueError, KeyError, TypeError):
+            self.send_error(400, 'Malformed webhook payload')
+            return
+        if record is not None:
+            self.server.store.append(record)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class RunnerGroup(NamedTuple):
+    size: int
+    tags: FrozenSet[str]
+    speed: float
+
+
+class SimJob(NamedTuple):
+    name: str
+    stage: str
+    duration: float
+    tags: FrozenSet[str]
+
+
+# (duration, tags, indices of the jobs it has to wait for)
+SimGraph = List[Tuple[float, FrozenSet[str], List[int]]]
+
+# (seq, pipeline index, job index, time when the job became ready)
+JobQueue = Deque[Tuple[int, int, int, float]]
+
+
+def parse_timestamp(timestamp: str) -> float:
+    # Python 3.10 doesn't understand the Z suffix
+    return datetime.datetime.fromisoformat(
+        timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def parse_runner_spec(spec: str) -> RunnerGroup:
+    rest, _, speed = spec.partition('@')
+    count, _, tags = rest.partition(':')
+    try:
+        runner = RunnerGroup(
+            size=int(count),
+            tags=frozenset(tag for tag in tags.split(',') if tag),
+            speed=float(speed) if speed else 1.0,
+        )
+    except ValueError:
+        runner = None
+    if runner is None or runner.size < 1 or not runner.speed > 0:
+        raise argparse.ArgumentTypeError(
+            'expected COUNT[:TAG,...][@SPEED], got {!r}'.format(spec))
+    return runner
+
+
+def parse_split_spec(spec: str) -> Tuple[str, int]:
+    name, _, count = spec.rpartition('=')
+    if not name or not count.isdigit() or int(count) < 1:
+        raise argparse.ArgumentTypeError(
+            'expected JOB=N, got {!r}'.format(spec))
+    return name, int(count)
+
+
+def parse_needs_spec(spec: str) -> Tuple[str, List[str]]:
+    name, eq, needs = spec.partition('=')
+    if not name or not eq:
+        raise argparse.ArgumentTypeError(
+            'expected JOB=[JOB,...], got {!r}'.format(spec))
+    return name, [need for need in needs.split(',') if need]
+
+
+def build_job_graph(
+    jobs: List[SimJob],
+    needs: Dict[str, List[str]],
+    splits: Dict[str, int],
+) -> SimGraph:
+    """Work out which jobs of a pipeline wait for which other jobs.
+
+    ``jobs`` must be listed in the order GitLab created them (i.e. sorted
+    by job ID), which gives us the order of the stages.  Jobs listed in
+    ``needs`` wait only for the jobs they need, all other jobs wait for all
+    the jobs in earlier stages.  Jobs listed in ``splits`` are replaced by
+    the given number of parallel jobs, each taking a fraction of the time.
+    """
+    expanded = []
+    for job in jobs:
+        parts = splits.get(job.name, 1)
+        expanded += [job._replace(duration=job.duration / parts)] * parts
+    stages = list(dict.fromkeys(job.stage for job in expanded))
+    by_name = defaultdict(list)  # type: Dict[str, List[int]]
+    by_stage = defaultdict(list)  # type: Dict[str, List[int]]
+    for i, job in enumerate(expanded):
+        by_name[job.name].append(i)
+        by_stage[job.stage].append(i)
+    graph = []
+    for job in expanded:
+        if job.name in needs:
+            deps = [i for need in needs[job.name] for i in by_name[need]]
+        else:
+            earlier_stages = stages[:stages.index(job.stage)]
+            deps = [i for stage in earlier_stages for i in by_stage[stage]]
+        graph.append((job.duration, job.tags, deps))
+    return graph
+
+
+def run_simulation(
+    pipelines: List[SimGraph],
+    arrivals: List[float],
+    runners: List[RunnerGroup],
+) -> Tuple[List[float], List[float]]:
+    """Simulate running pipelines on a pool of runners.
+
+    ``arrivals`` are the times (in seconds) when each pipeline gets created.
+    Each job goes into a FIFO queue once all the jobs it waits for are done,
+    and gets picked up by the fastest free runner that has all of its tags.
+
+    Returns a list of pipeline wall times and a list of job queue times.
+    """
+    seq = itertools.count()
+    # (time, seq, pipeline, job or -1 for pipeline arrival, runner group)
+    events = [
+        (arrival, next(seq), p, -1, -1) for p, arrival in enumerate(arrivals)
+    ]
+    heapq.heapify(events)
+    free = [runner.size for runner in runners]
+    fastest_first = sorted(range(len(runners)),
+                           key=lambda g: -runners[g].speed)
+    # one FIFO queue per set of job tags
+    queues = {}  # type: Dict[FrozenSet[str], JobQueue]
+    compatible_queues = [
+        [] for runner in runners
+    ]  # type: List[List[JobQueue]]
+    waiting_for = {}  # type: Dict[int, List[int]]
+    dependents = {}  # type: Dict[int, List[List[int]]]
+    jobs_left = {}  # type: Dict[int, int]
+    wall_times = []
+    queue_times = []
+
+    def enqueue(now: float, p: int, j: int) -> None:
+        tags = pipelines[p][j][1]
+        if tags not in queues:
+            queues[tags] = collections.deque()
+            for g, runner in enumerate(runners):
+                if tags <= runner.tags:
+                    compatible_queues[g].append(queues[tags])
+        queues[tags].append((next(seq), p, j, now))
+
+    while events:
+        now, _, p, j, g = heapq.heappop(events)
+        if j < 0:
+            graph = pipelines[p]
+            waiting_for[p] = [len(deps) for duration, tags, deps in graph]
+            dependents[p] = [[] for job in graph]
+            for k, (duration, tags, deps) in enumerate(graph):
+                for dep in deps:
+                    dependents[p][dep].append(k)
+            jobs_left[p] = len(graph)
+            if not graph:
+                wall_times.append(0.0)
+            for k, count in enumerate(waiting_for[p]):
+                if count == 0:
+                    enqueue(now, p, k)
+        else:
+            free[g] += 1
+            for k in dependents[p][j]:
+                waiting_for[p][k] -= 1
+                if waiting_for[p][k] == 0:
+                    enqueue(now, p, k)
+            jobs_left[p] -= 1
+            if jobs_left[p] == 0:
+                wall_times.append(now - arrivals[p])
+                del waiting_for[p], dependents[p], jobs_left[p]
+        for g in fastest_first:
+            while free[g]:
+                best = None
+                for queue in compatible_queues[g]:
+                    if queue and (best is None or queue[0][0] < best[0][0]):
+                        best = queue
+                if best is None:
+                    break
+                _, bp, bj, ready = best.popleft()
+                queue_times.append(now - ready)
+                free[g] -= 1
+                finish = now + pipelines[bp][bj][0] / runners[g].speed
+                heapq.heappush(events, (finish, next(seq), bp, bj, g))
+    return wall_times, queue_times
+
+
 def fmt_status(status: str) -> str:
     colors = {
         'success': colorama.Fore.GREEN,
@@ -83,7 +1384,265 @@ def fmt_status(status: str) -> str:
     return colors[status] + status + colorama.Style.RESET_ALL
 
 
-parser = argparse.ArgumentParser(description=__doc__)
+class Progress:
+    """Live progress line for long crawls, written to stderr."""
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.requests = 0
+        self.started = time.monotonic()
+
+    def start(self, total: int) -> None:
+        self.total = total
+        self.requests = 0
+        self.started = time.monotonic()
+
+    def count_request(self, response: requests.Response, *args: Any,
+                      **kwargs: Any) -> None:
+        # a requests response hook
+        self.requests += 1
+
+    def show(self, done: int) -> None:
+        elapsed = max(time.monotonic() - self.started, 1e-3)
+        rate = done / elapsed
+        eta = (self.total - done) / rate if rate else 0
+        sys.stderr.write(
+            "\r{done}/{total} pipelines, {rate:.1f} pipelines/s,"
+            " {rps:.1f} requests/s, ETA {eta:.0f}s\033[K".format(
+                done=done, total=self.total, rate=rate,
+                rps=self.requests / elapsed, eta=max(eta, 0)))
+        sys.stderr.flush()
+
+    def clear(self) -> None:
+        sys.stderr.write("\r\033[K")
+        sys.stderr.flush()
+
+
+def print_summary(
+    heading: str,
+    job_durations: Dict[str, List[float]],
+    pipeline_durations: List[float],
+    population: Optional[int] = None,
+) -> None:
+    print("\n" + heading)
+    to_show = sorted(job_durations.items()) + [('overall', pipeline_durations)]
+    maxlen = max(len(name) for name, durations in to_show)
+    digits = 4.1
+    unit = "m", 60.0
+    template = (
+        "  {name:{maxlen}} "
+        " min {min:{digits}f}{unit},"
+        " max {max:{digits}f}{unit},"
+        " avg {avg:{digits}f}{unit},"
+        " median {median:{digits}f}{unit},"
+        " stdev {stdev:{digits}f}{unit}"
+    )
+    if population:
+        template += ", avg 95% CI \u00b1{ci:.1f}{unit}"
+    for job_name, durations in to_show:
+        print(
+            template.format(
+                name=job_name,
+                maxlen=maxlen,
+                digits=digits,
+                unit=unit[0],
+                min=min(durations) / unit[1],
+                max=max(durations) / unit[1],
+                avg=mean(durations) / unit[1],
+                median=median(durations) / unit[1],
+                stdev=stdev(durations) / unit[1] if len(durations) > 1 else 0,
+                ci=(confidence_interval(durations, population) / unit[1]
+                    if population else 0),
+            )
+        )
+
+
+def print_sections(
+    heading: str,
+    section_durations: Dict[str, Dict[str, List[float]]],
+) -> None:
+    print("\n" + heading)
+    digits = 4.1
+    unit = "m", 60.0
+    for job_name, sections in sorted(section_durations.items()):
+        print("  {name}".format(name=job_name))
+        maxlen = max(len(name) for name in sections)
+        for section, durations in sections.items():
+            print(
+                "    {name:{maxlen}} "
+                " min {min:{digits}f}{unit},"
+                " median {median:{digits}f}{unit},"
+                " p95 {p95:{digits}f}{unit}"
+                .format(
+                    name=section,
+                    maxlen=maxlen,
+                    digits=digits,
+                    unit=unit[0],
+                    min=min(durations) / unit[1],
+                    median=median(durations) / unit[1],
+                    p95=percentile(durations, 95) / unit[1],
+                )
+            )
+
+
+def print_runner_time(by_job: RunnerTime, by_stage: RunnerTime) -> None:
+    overall = defaultdict(float)  # type: Dict[str, float]
+    for outcomes in by_stage.values():
+        for outcome, seconds in outcomes.items():
+            overall[outcome] += seconds
+    tables = [
+        ("Runner minutes by job, including failed and retried attempts:",
+         'job', sorted(by_job.items())),
+        ("Runner minutes by stage:",
+         'stage', sorted(by_stage.items()) + [('overall', overall)]),
+    ]
+    maxlen = max(len(name) for _, _, rows in tables for name, _ in rows)
+    template = (
+        "  {name:{maxlen}}"
+        " {total:7.1f} {success:8.1f} {failed:7.1f} {canceled:9.1f}"
+        " {retried:8.1f} {wasted:6.0f}%"
+    )
+    for heading, what, rows in tables:
+        print("\n" + heading)
+        print("  {what:{maxlen}}   total  success  failed  canceled"
+              "  retried  wasted".format(what=what, maxlen=maxlen))
+        for name, outcomes in rows:
+            total = sum(outcomes.values())
+            wasted = sum(outcomes[outcome] for outcome in WASTED_OUTCOMES)
+            print(template.format(
+                name=name,
+                maxlen=maxlen,
+                total=total / 60.0,
+                success=outcomes['success'] / 60.0,
+                failed=outcomes['failed'] / 60.0,
+                canceled=outcomes['canceled'] / 60.0,
+                retried=outcomes['retried'] / 60.0,
+                wasted=100.0 * wasted / total if total else 0,
+            ))
+
+
+def fmt_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'GiB'
+    return '{size:.1f} {unit}'.format(size=size, unit=unit)
+
+
+def print_artifacts(
+    job_artifacts: Dict[str, List[Tuple[int, float]]],
+    pipeline_artifacts: List[Tuple[int, float]],
+    unused_artifacts: Dict[str, List[int]],
+) -> None:
+    rows = sorted(job_artifacts.items()) + [('overall', pipeline_artifacts)]
+    maxlen = max(len(name) for name, sizes in rows)
+    print("\nArtifacts, not counting job logs:")
+    print("  {what:{maxlen}}   avg size   max size  growth  r(duration)"
+          .format(what='job', maxlen=maxlen))
+    growths = {}
+    for name, sizes in rows:
+        values = [size for size, duration in sizes]  # type: List[float]
+        job_growth = growth(values)
+        r = duration_correlation(sizes)
+        if job_growth is not None and name != 'overall':
+            growths[name] = job_growth
+        print(
+            "  {name:{maxlen}} {avg:>10} {max:>10} {growth:>7} {r:>12}".format(
+                name=name,
+                maxlen=maxlen,
+                avg=fmt_size(mean(values)),
+                max=fmt_size(max(values)),
+                growth=('{:+.0%}'.format(job_growth)
+                        if job_growth is not None else 'n/a'),
+                r='{:+.2f}'.format(r) if r is not None else 'n/a',
+            )
+        )
+    growing = sorted(
+        (name for name, job_growth in growths.items()
+         if job_growth >= ARTIFACT_GROWTH),
+        key=growths.__getitem__, reverse=True)[:MAX_ARTIFACT_GROWTH_SHOWN]
+    if growing:
+        print("\nGrew the most:")
+        for name in growing:
+            older, newer = cast(Tuple[float, float], half_means(
+                [size for size, duration in job_artifacts[name]]))
+            print("  {name:{maxlen}}  {growth:+.0%}, from {older} to {newer}"
+                  .format(name=name, maxlen=maxlen, growth=growths[name],
+                          older=fmt_size(older), newer=fmt_size(newer)))
+    unused = {
+        name: mean(unused_sizes)
+        for name, unused_sizes in sorted(unused_artifacts.items())
+        if mean(unused_sizes) >= LARGE_ARTIFACTS
+    }
+    if unused:
+        print("\nLarge artifacts from the last stage, which no later job can"
+              " download:")
+        for name, avg in unused.items():
+            print("  {name:{maxlen}}  avg {avg}".format(
+                name=name, maxlen=maxlen, avg=fmt_size(avg)))
+
+
+# options for selecting the pipelines to analyse, shared by all commands
+source_parser = argparse.ArgumentParser(add_help=False)
+source_parser.add_argument(
+    '-g', '--gitlab',
+    help='select configuration section in ~/.python-gitlab.cfg',
+)
+source_parser.add_argument(
+    '-p', '--project', metavar='ID',
+    help='select GitLab project ("group/project" or the numeric ID)',
+)
+source_parser.add_argument(
+    '-b', '--branch', '--ref', metavar='REF', default='master',
+    help='select git branch',
+)
+source_parser.add_argument(
+    '--all-branches', action='store_const', const=None, dest='branch',
+    help='do not filter by git branch',
+)
+source_parser.add_argument(
+    '--all-pipelines', action='store_true',
+    help='include pipelines that were not successful',
+)
+source_parser.add_argument(
+    '-l', '--limit', metavar='N', default=20, type=int,
+    help='limit analysis to last N pipelines',
+)
+source_parser.add_argument(
+    '--since', metavar='DATE',
+    help='only look at pipelines updated after DATE (e.g. 2024-01-31)',
+)
+source_parser.add_argument(
+    '--until', metavar='DATE',
+    help='only look at pipelines updated before DATE',
+)
+source_parser.add_argument(
+    '--fast', action='store_true',
+    help=(
+        'use a leaner GitLab API client that keeps only the data we need'
+        ' (uses about a fifth of the memory with a large --limit)'
+    ),
+)
+source_parser.add_argument(
+    '--store', metavar='FILENAME',
+    help=(
+        "read pipelines from a local store written by 'gitlab-jobs ingest'"
+        " instead of querying the GitLab API"
+    ),
+)
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__,
+    epilog=(
+        "See also 'gitlab-jobs ingest --help' for collecting pipeline data"
+        " via webhooks, and 'gitlab-jobs simulate --help' for predicting"
+        " pipeline durations with a different set of runners."
+    ),
+    parents=[source_parser],
+)
 parser.add_argument(
     '--version', action='version',
     # *sigh* argparse converts the \n to a space anyway
@@ -98,141 +1657,613 @@ parser.add_argument(
     help='print more information',
 )
 parser.add_argument(
-    '-g', '--gitlab',
-    help='select configuration section in ~/.python-gitlab.cfg',
+    '--sample', metavar='N', type=int,
+    help=(
+        'instead of the last --limit pipelines analyse N pipelines spread'
+        ' across the whole history (or --since/--until date range), and'
+        ' show confidence intervals for the averages'
+    ),
 )
 parser.add_argument(
-    '-p', '--project', metavar='ID',
-    help='select GitLab project ("group/project" or the numeric ID)',
+    '--sample-by', choices=['even', 'week'], default='even',
+    help=(
+        'pick sampled pipelines evenly across the whole range, or'
+        ' proportionally from every week (default: %(default)s)'
+    ),
 )
 parser.add_argument(
-    '-b', '--branch', '--ref', metavar='REF', default='master',
-    help='select git branch',
+    '--max-time', metavar='SECONDS', type=float,
+    help=(
+        'stop fetching data from GitLab (pipelines, or job logs for'
+        ' --sections) after this many seconds and show a partial summary of'
+        ' what was fetched so far'
+    ),
 )
 parser.add_argument(
-    '--all-branches', action='store_const', const=None, dest='branch',
-    help='do not filter by git branch',
-)
-parser.add_argument(
-    '--all-pipelines', action='store_true',
-    help='include pipelines that were not successful',
+    '--progress', action='store_true',
+    help='show a live progress line (with speed and ETA) on stderr',
 )
 parser.add_argument(
-    '-l', '--limit', metavar='N', default=20, type=int,
-    help='limit analysis to last N pipelines',
+    '--summary-every', metavar='N', type=int,
+    help='print an interim summary after every N pipelines',
 )
 parser.add_argument(
     '--csv', metavar='FILENAME',
     help='export raw data to CSV file',
 )
+parser.add_argument(
+    '--append-csv', metavar='FILENAME',
+    help=(
+        'fetch only pipelines that are not recorded in the CSV file yet and'
+        ' add their data to it (--limit applies only when creating the file)'
+    ),
+)
+parser.add_argument(
+    '--jsonl', metavar='FILENAME',
+    help=(
+        'export pipelines and jobs, with their timestamps, stages and'
+        ' runners, to a JSONL file (in the same format as --store)'
+    ),
+)
+parser.add_argument(
+    '--compare', metavar=('REF_A', 'REF_B'), nargs=2,
+    help=(
+        'compare job durations in two git branches and show which jobs are'
+        ' significantly slower or faster in REF_B'
+    ),
+)
+parser.add_argument(
+    '--cost', action='store_true',
+    help=(
+        'show the runner time spent on all job attempts, including failed,'
+        ' canceled and retried ones'
+    ),
+)
+parser.add_argument(
+    '--artifacts', action='store_true',
+    help=(
+        'show artifact sizes of jobs and pipelines, how they change, and'
+        ' how they relate to job durations'
+    ),
+)
+parser.add_argument(
+    '--sections', action='store_true',
+    help='download job logs and show how long each log section took',
+)
+parser.add_argument(
+    '--workers', metavar='N', default=8, type=int,
+    help='number of job logs to download concurrently (default: %(default)s)',
+)
+parser.add_argument(
+    '--cache-dir', metavar='DIR',
+    help='where to cache downloaded job logs (default: ~/.cache/gitlab-jobs)',
+)
 parser.add_argument(
     '--debug', action='store_true',
     help='print even more information, for debugging',
 )
+# main() sets this from --max-time
+parser.set_defaults(deadline=None)
 
+ingest_parser = argparse.ArgumentParser(
+    prog='gitlab-jobs ingest',
+    description=(
+        "Receive GitLab pipeline and job webhooks and store finished"
+        " pipelines and jobs in a local file, for use with"
+        " 'gitlab-jobs --store'."
+    ),
+)
+ingest_parser.add_argument(
+    '-v', '--verbose', action='store_true',
+    help='log every received webhook',
+)
+ingest_parser.add_argument(
+    '--store', metavar='FILENAME', required=True,
+    help='JSONL file to append pipelines and jobs to',
+)
+ingest_parser.add_argument(
+    '--listen', metavar='[HOST:]PORT', default='localhost:8080',
+    help='address to listen on (default: %(default)s)',
+)
+ingest_parser.add_argument(
+    '--secret-token', metavar='TOKEN',
+    help=(
+        'the secret token configured for the webhook in GitLab'
+        ' (default: $GITLAB_WEBHOOK_TOKEN)'
+    ),
+)
+ingest_parser.add_argument(
+    '--replay', metavar='FILENAME', nargs='+',
+    help=(
+        'store recorded webhook payloads (JSON files) instead of listening'
+        ' for webhooks'
+    ),
+)
 
-def main():
-    colorama.init()
 
-    args = parser.parse_args()
+def parse_listen_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
 
-    if not args.project:
-        args.project = get_project_name_from_git_url()
 
-    if not args.project:
-        parser.error('please specify gitlab project ID, e.g. -p mygroup/hello')
+def ingest(argv: List[str]) -> None:
+    args = ingest_parser.parse_args(argv)
+    store = Store(args.store)
 
-    gl = gitlab.Gitlab.from_config(args.gitlab)
-    project = gl.projects.get(args.project)
+    if args.replay:
+        for filename in args.replay:
+            with open(filename) as f:
+                payload = json.load(f)
+            event = WEBHOOK_EVENTS.get(payload.get('object_kind'))
+            record = record_from_webhook(event, payload)
+            if record is None:
+                print("Skipping {filename}: not a finished pipeline or job"
+                      .format(filename=filename))
+                continue
+            store.append(record)
+            print("Stored {kind} {id} from {filename}".format(
+                filename=filename, **record))
+        return
 
-    pipeline_durations = []
-    job_durations = defaultdict(list)
+    secret_token = (
+        args.secret_token or os.environ.get('GITLAB_WEBHOOK_TOKEN'))
+    if not secret_token:
+        ingest_parser.error(
+            'please specify the webhook secret token with --secret-token'
+            ' or $GITLAB_WEBHOOK_TOKEN')
+    try:
+        address = parse_listen_address(args.listen)
+    except ValueError:
+        ingest_parser.error('bad --listen address: {}'.format(args.listen))
+    server = WebhookServer(address, store, secret_token, args.verbose)
+    print("Listening for GitLab webhooks on http://{host}:{port}/".format(
+        host=address[0], port=server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
-    pipelines = 'pipelines' if args.all_pipelines else 'successful pipelines'
-    if args.branch is None:
-        template = "Last {n} {pipelines} of {project}:"
-    else:
-        template = "Last {n} {pipelines} of {project} {ref}:"
-    print(template.format(
-        n=args.limit, pipelines=pipelines, ref=args.branch,
-        project=project.name))
-    pipelines = get_pipelines(project, args)
-    for pipeline in pipelines:
-        template = "  {id} ({date}, commit {sha_short}"
-        if args.verbose:
-            template += " by {user[name]}"
-        if args.branch is None:
-            template += " on {ref}"
-        # pipeline data returned in the list contains only a small subset
-        # of information, so we need an extra HTTP GET to fetch duration
-        # and user
+
+simulate_parser = argparse.ArgumentParser(
+    prog='gitlab-jobs simulate',
+    description=(
+        "Replay recorded pipelines through a simulated pool of runners and"
+        " predict pipeline wall times and job queue times."
+    ),
+    parents=[source_parser],
+)
+simulate_parser.add_argument(
+    '--runner', metavar='COUNT[:TAG,...][@SPEED]', type=parse_runner_spec,
+    action='append', dest='runners',
+    help=(
+        'add COUNT runners with the given tags and speed factor (e.g.'
+        ' --runner 4:docker@1.5 means 4 runners tagged "docker" that run'
+        ' jobs 1.5 times faster); can be repeated (default: as many'
+        ' runners as ran the recorded jobs)'
+    ),
+)
+simulate_parser.add_argument(
+    '--arrival-rate', metavar='N', type=float,
+    help=(
+        'create N pipelines per hour at random (default: replay the'
+        ' recorded pipeline creation times)'
+    ),
+)
+simulate_parser.add_argument(
+    '--split', metavar='JOB=N', type=parse_split_spec, action='append',
+    default=[],
+    help='split JOB into N parallel jobs; can be repeated',
+)
+simulate_parser.add_argument(
+    '--needs', metavar='JOB=[JOB,...]', type=parse_needs_spec,
+    action='append', default=[],
+    help=(
+        'make JOB wait only for the listed jobs instead of all jobs in'
+        ' earlier stages; can be repeated'
+    ),
+)
+simulate_parser.add_argument(
+    '--seed', metavar='N', type=int, default=0,
+    help='random seed for --arrival-rate (default: %(default)s)',
+)
+
+
+def load_simulation_data(
+    project: 'gitlab.v4.objects.Project',
+    args: argparse.Namespace,
+) -> Tuple[List[Tuple[float, Optional[float], List[SimJob]]], int]:
+    """Load pipelines for simulation.
+
+    Returns a list of (creation timestamp, recorded duration, jobs) for
+    every pipeline, oldest first, and the number of distinct runners that
+    ran those jobs.
+    """
+    pipelines = []
+    runner_ids = set()
+    for pipeline in get_pipelines(project, args):
         pipeline = project.pipelines.get(pipeline.id)
-        attrs = dict(pipeline.attributes)
-        if pipeline.duration is not None:
-            template += ", duration {duration_min:.1f}m)"
-            pipeline_durations.append(pipeline.duration)
-            attrs['duration_min'] = pipeline.duration / 60.0
-        else:
-            template += ")"
-        if pipeline.status != 'success':
-            template += ' - {color_status}'
-        attrs['sha_short'] = attrs['sha'][:8]
-        attrs['date'] = attrs['created_at'][:len('YYYY-MM-DD')]
-        attrs['color_status'] = fmt_status(pipeline.status)
-        print(template.format_map(attrs))
-        if args.debug:
-            print("   ", json.dumps(pipeline.attributes))
-        for job in get_jobs(pipeline, args):
-            if job.duration is not None:
-                job_durations[job.name].append(job.duration)
-            if args.verbose and job.duration is not None:
-                template = "    {name:30}  {duration_min:4.1f}m"
-                if job.status != 'success':
-                    template += ' - {color_status}'
-                print(template.format(
-                    duration_min=job.duration / 60.0,
-                    color_status=fmt_status(job.status),
-                    **job.attributes))
-                if args.debug:
-                    print("     ", json.dumps(job.attributes))
+        jobs = []
+        for job in sorted(get_jobs(pipeline, args), key=lambda job: job.id):
+            if job.duration is None:
+                continue
+            tags = getattr(job, 'tag_list', None) or ()
+            jobs.append(SimJob(job.name, job.stage, job.duration,
+                               frozenset(tags)))
+            if job.runner:
+                runner_ids.add(job.runner['id'])
+        pipelines.append(
+            (parse_timestamp(pipeline.created_at), pipeline.duration, jobs))
+    pipelines.sort(key=lambda pipeline: pipeline[0])
+    return pipelines, len(runner_ids)
 
-    if not pipeline_durations:
-        print("\nNo finished pipelines found.")
-        return
 
-    print("\nSummary:")
-    to_show = sorted(job_durations.items()) + [('overall', pipeline_durations)]
-    maxlen = max(len(name) for name, durations in to_show)
+def print_distributions(
+    distributions: List[Tuple[str, List[float]]],
+) -> None:
+    maxlen = max(len(name) for name, values in distributions)
     digits = 4.1
     unit = "m", 60.0
-    for job_name, durations in to_show:
+    for name, values in distributions:
+        if not values:
+            print("  {name:{maxlen}}  n/a".format(name=name, maxlen=maxlen))
+            continue
         print(
             "  {name:{maxlen}} "
             " min {min:{digits}f}{unit},"
-            " max {max:{digits}f}{unit},"
-            " avg {avg:{digits}f}{unit},"
             " median {median:{digits}f}{unit},"
-            " stdev {stdev:{digits}f}{unit}"
+            " p95 {p95:{digits}f}{unit},"
+            " max {max:{digits}f}{unit}"
             .format(
-                name=job_name,
+                name=name,
                 maxlen=maxlen,
                 digits=digits,
                 unit=unit[0],
-                min=min(durations) / unit[1],
-                max=max(durations) / unit[1],
-                avg=mean(durations) / unit[1],
-                median=median(durations) / unit[1],
-                stdev=stdev(durations) / unit[1] if len(durations) > 1 else 0,
+                min=min(values) / unit[1],
+                median=median(values) / unit[1],
+                p95=percentile(values, 95) / unit[1],
+                max=max(values) / unit[1],
             )
         )
 
+
+def simulate(argv: List[str]) -> None:
+    args = simulate_parser.parse_args(argv)
+    project = open_project(args, simulate_parser)
+
+    pipelines = 'pipelines' if args.all_pipelines else 'successful pipelines'
+    if args.branch is None:
+        template = "Loading last {n} {pipelines} of {project}..."
+    else:
+        template = "Loading last {n} {pipelines} of {project} {ref}..."
+    print(template.format(
+        n=args.limit, pipelines=pipelines, ref=args.branch,
+        project=project.name))
+    recorded, runners_seen = load_simulation_data(project, args)
+    if not recorded:
+        print("\nNo pipelines found.")
+        return
+
+    all_tags = frozenset(
+        tag for created, duration, jobs in recorded
+        for job in jobs for tag in job.tags)
+    runners = args.runners or [RunnerGroup(max(1, runners_seen), all_tags, 1)]
+    for tags in sorted({job.tags for _, _, jobs in recorded for job in jobs},
+                       key=sorted):
+        if not any(tags <= runner.tags for runner in runners):
+            simulate_parser.error(
+                'no runner can run jobs with tags {}'.format(
+                    ', '.join(sorted(tags))))
+
+    needs = dict(args.needs)
+    splits = dict(args.split)
+    graphs = [
+        build_job_graph(jobs, needs, splits)
+        for created, duration, jobs in recorded
+    ]
+    if args.arrival_rate:
+        rng = random.Random(args.seed)
+        arrivals = list(itertools.accumulate(
+            rng.expovariate(args.arrival_rate / 3600) for graph in graphs))
+    else:
+        arrivals = [
+            created - recorded[0][0] for created, duration, jobs in recorded
+        ]
+    wall_times, queue_times = run_simulation(graphs, arrivals, runners)
+
+    print("\nRunners:")
+    for runner in runners:
+        print("  {size} x {tags} @{speed:g}".format(
+            size=runner.size, speed=runner.speed,
+            tags=', '.join(sorted(runner.tags)) or '(untagged)'))
+    print("\nSimulated {n} pipelines:".format(n=len(graphs)))
+    print_distributions([
+        ('recorded wall time', [
+            duration for created, duration, jobs in recorded
+            if duration is not None
+        ]),
+        ('simulated wall time', wall_times),
+        ('simulated queue time', queue_times),
+    ])
+
+
+def open_project(
+    args: argparse.Namespace,
+    parser: argparse.ArgumentParser,
+    progress: Optional[Progress] = None,
+) -> 'gitlab.v4.objects.Project':
+    if args.store:
+        # StoredProject implements only the bits of Project that we use
+        return cast('gitlab.v4.objects.Project',
+                    StoredProject(Store(args.store), args.project))
+
+    if not args.project:
+        args.project = get_project_name_from_git_url()
+
+    if not args.project:
+        parser.error('please specify gitlab project ID, e.g. -p mygroup/hello')
+
+    gl = gitlab.Gitlab.from_config(args.gitlab)
+    if progress is not None:
+        gl.session.hooks['response'].append(progress.count_request)
+    if args.fast:
+        # keep enough connections open for concurrent downloads
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+        gl.session.mount('https://', adapter)
+        gl.session.mount('http://', adapter)
+        return cast('gitlab.v4.objects.Project', FastProject(gl, args.project))
+    return gl.projects.get(args.project)
+
+
+def main():
+    commands = {
+        'ingest': ingest,
+        'simulate': simulate,
+    }
+    if sys.argv[1:2] and sys.argv[1] in commands:
+        commands[sys.argv[1]](sys.argv[2:])
+        return
+
+    colorama.init()
+
+    args = parser.parse_args()
+
+    if args.store and args.sections:
+        parser.error('--sections needs job logs from the GitLab API'
+                     ' and cannot be used with --store')
+
+    if args.sample is not None:
+        if args.sample < 1:
+            parser.error('--sample needs a positive number')
+        if args.append_csv or args.compare:
+            parser.error('--sample cannot be used with --append-csv'
+                         ' or --compare')
+
+    if (args.append_csv and os.path.exists(args.append_csv)
+            and not os.path.exists(get_csv_index_filename(args.append_csv))):
+        # we'd have no idea which pipelines the file already covers
+        parser.error('{} was not created by --append-csv ({} is missing);'
+                     ' remove it or use --csv to overwrite it'.format(
+                         args.append_csv,
+                         get_csv_index_filename(args.append_csv)))
+
+    if args.compare:
+        ignored = [
+            option for option, value in [
+                ('--csv', args.csv),
+                ('--append-csv', args.append_csv),
+                ('--jsonl', args.jsonl),
+                ('--cost', args.cost),
+                ('--artifacts', args.artifacts),
+                ('--sections', args.sections),
+                ('--summary-every', args.summary_every),
+                ('--progress', args.progress),
+            ] if value
+        ]
+        if ignored:
+            parser.error('--compare cannot be used with {}'.format(
+                ', '.join(ignored)))
+
+    if args.summary_every is not None and args.summary_every < 1:
+        parser.error('--summary-every needs a positive number')
+
+    if args.max_time is not None:
+        args.deadline = time.monotonic() + args.max_time
+    progress = Progress() if args.progress else None
+
+    project = open_project(args, parser, progress)
+
+    if args.compare:
+        compare_refs(project, args)
+        return
+
+    pipeline_durations = []
+    job_durations = defaultdict(list)
+    analysed_jobs = []
+    runner_time_by_job = defaultdict(collections.Counter)
+    runner_time_by_stage = defaultdict(collections.Counter)
+    job_artifacts = defaultdict(list)
+    pipeline_artifacts = []
+    unused_artifacts = defaultdict(list)
+
+    population = None
+    known_ids = set(read_csv_index(args.append_csv) if args.append_csv else [])
+    watermark = (
+        read_csv_watermark(args.append_csv) if args.append_csv else None)
+    incremental = bool(known_ids or watermark)
+    pipelines = 'pipelines' if args.all_pipelines else 'successful pipelines'
+    pipeline_ids = []
+    updated = [watermark]
+    records = []
+    stopped = None
+    try:
+        if args.sample:
+            sample, population = sample_pipelines(project, args)
+            template = "{n} of {total} {pipelines} of {project}"
+        elif incremental:
+            sample = get_new_pipelines(project, args, known_ids, watermark)
+            template = "{n} new {pipelines} of {project}"
+        else:
+            template = "Last {n} {pipelines} of {project}"
+        if args.branch is not None:
+            template += " {ref}"
+        if args.sample:
+            template += ", sampled {how}:"
+        else:
+            template += ":"
+        print(template.format(
+            n=len(sample) if args.sample or incremental else args.limit,
+            total=population, pipelines=pipelines, ref=args.branch,
+            project=project.name,
+            how='evenly' if args.sample_by == 'even' else 'every week'))
+        if args.sample or incremental:
+            pipelines = sample
+        else:
+            pipelines = get_pipelines(project, args)
+        if progress is not None:
+            progress.start(
+                len(sample) if args.sample or incremental else args.limit)
+        for pipeline in pipelines:
+            if out_of_time(args):
+                raise TimeLimitReached()
+            if progress is not None:
+                progress.clear()
+            pipeline_ids.append(pipeline.id)
+            updated.append(pipeline.updated_at)
+            template = "  {id} ({date}, commit {sha_short}"
+            if args.verbose:
+                template += " by {user[name]}"
+            if args.branch is None:
+                template += " on {ref}"
+            # pipeline data returned in the list contains only a small
+            # subset of information, so we need an extra HTTP GET to fetch
+            # duration and user
+            pipeline = project.pipelines.get(pipeline.id)
+            if pipeline.duration is not None:
+                template += ", duration {duration_min:.1f}m)"
+                pipeline_durations.append(pipeline.duration)
+            else:
+                template += ")"
+            if pipeline.status != 'success':
+                template += ' - {color_status}'
+            print(template.format(
+                id=pipeline.id,
+                date=pipeline.created_at[:len('YYYY-MM-DD')],
+                sha_short=pipeline.sha[:8],
+                user=pipeline.user,
+                ref=pipeline.ref,
+                duration_min=(pipeline.duration or 0) / 60.0,
+                color_status=fmt_status(pipeline.status),
+            ))
+            if args.debug:
+                print("   ", json.dumps(pipeline.attributes))
+            if args.cost:
+                attempts = get_job_attempts(pipeline)
+                add_runner_time(runner_time_by_job, runner_time_by_stage,
+                                attempts)
+                jobs = select_jobs(attempts, args)
+            else:
+                jobs = get_jobs(pipeline, args)
+            if args.jsonl:
+                records.append(record_from_api(project, pipeline, jobs))
+            if args.artifacts:
+                final_stage = last_stage(jobs)
+                for job in jobs:
+                    if job.duration is None:
+                        continue
+                    job_artifacts[job.name].append(
+                        (artifact_size(job), job.duration))
+                    if job.stage == final_stage:
+                        unused_artifacts[job.name].append(
+                            artifact_size(job, DOWNLOADED_ARTIFACTS))
+                if pipeline.duration is not None:
+                    pipeline_artifacts.append((
+                        sum(artifact_size(job) for job in jobs),
+                        pipeline.duration))
+            for job in jobs:
+                if job.duration is not None:
+                    job_durations[job.name].append(job.duration)
+                    analysed_jobs.append(job)
+                if args.verbose and job.duration is not None:
+                    template = "    {name:30}  {duration_min:4.1f}m"
+                    if job.status != 'success':
+                        template += ' - {color_status}'
+                    print(template.format(
+                        name=job.name,
+                        duration_min=job.duration / 60.0,
+                        color_status=fmt_status(job.status),
+                    ))
+                    if args.debug:
+                        print("     ", json.dumps(job.attributes))
+            if (args.summary_every and pipeline_durations
+                    and len(pipeline_ids) % args.summary_every == 0):
+                print_summary(
+                    "Interim summary of {n} pipelines:".format(
+                        n=len(pipeline_ids)),
+                    job_durations, pipeline_durations, population)
+                print()
+            if progress is not None:
+                progress.show(len(pipeline_ids))
+    except TimeLimitReached:
+        stopped = 'time limit reached'
+    except KeyboardInterrupt:
+        stopped = 'interrupted'
+    if progress is not None:
+        progress.clear()
+
+    if not pipeline_durations:
+        print("\nNo finished pipelines found{why}.".format(
+            why=' ({})'.format(stopped) if stopped else ''))
+        if args.append_csv and pipeline_ids and not stopped:
+            print("\nUpdating {filename}...".format(filename=args.append_csv))
+            append_csv(args.append_csv, {}, pipeline_ids,
+                       latest_timestamp(updated))
+        return
+
+    if stopped:
+        heading = "Partial summary of {n} pipelines ({why}):".format(
+            n=len(pipeline_ids), why=stopped)
+    else:
+        heading = "Summary:"
+    print_summary(heading, job_durations, pipeline_durations, population)
+
+    if args.cost:
+        print_runner_time(runner_time_by_job, runner_time_by_stage)
+
+    if args.artifacts:
+        print_artifacts(job_artifacts, pipeline_artifacts, unused_artifacts)
+
+    if stopped and args.sections:
+        print("\nSkipping sections: {why}.".format(why=stopped))
+    elif args.sections:
+        section_durations, skipped = get_section_durations(
+            project, analysed_jobs, args)
+        if skipped:
+            heading = ("Sections, partial (time limit reached, skipped {n} of"
+                       " {total} job logs):".format(
+                           n=skipped, total=len(analysed_jobs)))
+        else:
+            heading = "Sections:"
+        print_sections(heading, section_durations)
+
     if args.csv:
         print("\nWriting {filename}...".format(filename=args.csv))
-        with open(args.csv, 'w', newline='') as f:
-            writer = csv.writer(f)
-            for job_name, durations in sorted(job_durations.items()):
-                writer.writerow([job_name] + durations)
-            writer.writerow(['overall'] + pipeline_durations)
+        write_csv(args.csv, dict(job_durations, overall=pipeline_durations))
+
+    if args.append_csv and stopped:
+        # pipelines older than the ones we got would be skipped next time
+        print("\nNot updating {filename}: the results are partial.".format(
+            filename=args.append_csv))
+    elif args.append_csv:
+        print("\nUpdating {filename}...".format(filename=args.append_csv))
+        append_csv(args.append_csv,
+                   dict(job_durations, overall=pipeline_durations),
+                   pipeline_ids, latest_timestamp(updated))
+
+    if args.jsonl:
+        print("\nWriting {filename}...".format(filename=args.jsonl))
+        write_jsonl(args.jsonl, records)
 
 
 if __name__ == '__main__':
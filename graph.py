@@ -5,13 +5,27 @@ Graph GitLab pipeline job durations.
 
 import argparse
 import csv
+import datetime
+import json
 import math
+import os
 import signal
 import sys
-from typing import List, Optional, Tuple
+from collections import defaultdict
+from statistics import median
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 # apt install python3-matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.animation import FuncAnimation
+from matplotlib.artist import Artist
+from matplotlib.axes import Axes
+from matplotlib.cbook import pts_to_midstep
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 __version__ = '0.3.0'
@@ -19,6 +33,21 @@ __version__ = '0.3.0'
 
 JobInfo = Tuple[str, List[float]]
 
+# a pipeline record as written by gitlab-jobs --jsonl or gitlab-jobs ingest
+PipelineInfo = Dict[str, Any]
+
+# (stage or runner, job name, queued at, started at, finished at), with
+# times in seconds since the pipeline was created
+Bar = Tuple[str, str, float, float, float]
+
+# the raw data line, its fill, the rolling median line and the p10-p90 band
+# of a job in a plot_jobs() chart
+JobArtists = Tuple[
+    Line2D, PolyCollection, Optional[Line2D], Optional[PolyCollection]]
+
+
+DEFAULT_WINDOW = 10
+
 
 def load_csv(filename: str) -> List[JobInfo]:
     jobs = []
@@ -32,6 +61,117 @@ def load_csv(filename: str) -> List[JobInfo]:
     return jobs
 
 
+class JsonlReader:
+    """Read a JSONL file, and then whatever gets appended to it later.
+
+    Every poll() reads only the bytes added since the previous one.  If the
+    file gets truncated, replaced, or rewritten in place, it is read again
+    from the start.
+
+    With ``keep``, only the newest ``keep`` pipelines are kept in memory.
+    """
+
+    # how many of the last read bytes we check to notice in-place rewrites
+    tail_size = 4096
+
+    def __init__(self, filename: str, *, keep: Optional[int] = None) -> None:
+        self.filename = filename
+        self.keep = keep
+        self.reset()
+
+    def reset(self) -> None:
+        self.inode = None  # type: Optional[int]
+        self.mtime = None  # type: Optional[int]
+        self.offset = 0
+        self.tail = b''
+        self.partial_line = b''
+        self.pipelines = {}  # type: Dict[int, PipelineInfo]
+        self.jobs = defaultdict(
+            dict)  # type: Dict[int, Dict[int, Dict[str, Any]]]
+
+    def poll(self, *, final: bool = False) -> bool:
+        """Read new records, if any.  Returns True if there were some.
+
+        With ``final``, an unterminated last line is read too.
+        """
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return False
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.reset()
+        elif (st.st_size == self.offset and st.st_mtime_ns == self.mtime
+                and not final):
+            return False
+        with open(self.filename, 'rb') as f:
+            # if the bytes we read last time are not where we left them, the
+            # file was rewritten in place
+            f.seek(self.offset - len(self.tail))
+            if f.read(len(self.tail)) != self.tail:
+                self.reset()
+            f.seek(self.offset)
+            data = f.read()
+            self.offset = f.tell()
+        self.inode = st.st_ino
+        self.mtime = st.st_mtime_ns
+        self.tail = (self.tail + data)[-self.tail_size:]
+        lines = (self.partial_line + data).split(b'\n')
+        # the writer may not have finished the last line yet
+        self.partial_line = b'' if final else lines.pop()
+        for line in lines:
+            if line.strip():
+                self.add(json.loads(line))
+        self.prune()
+        return bool(lines)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        # later records replace earlier ones for the same pipeline/job
+        if record['kind'] == 'pipeline':
+            self.pipelines[record['id']] = record
+            for job in record['jobs']:
+                self.jobs[record['id']][job['id']] = job
+        elif record['kind'] == 'job':
+            self.jobs[record['pipeline_id']][record['id']] = record
+
+    def prune(self) -> None:
+        if not self.keep or len(self.pipelines) <= self.keep:
+            return
+        oldest_kept = sorted(self.pipelines)[-self.keep]
+        for pipeline_id in [i for i in self.pipelines if i < oldest_kept]:
+            del self.pipelines[pipeline_id]
+        for pipeline_id in [i for i in self.jobs if i < oldest_kept]:
+            del self.jobs[pipeline_id]
+
+    def get_pipelines(self) -> List[PipelineInfo]:
+        return [
+            dict(pipeline, jobs=list(self.jobs[pipeline_id].values()))
+            for pipeline_id, pipeline in sorted(
+                self.pipelines.items(), reverse=True)
+        ]
+
+
+def load_jsonl(filename: str) -> List[PipelineInfo]:
+    reader = JsonlReader(filename)
+    reader.poll(final=True)
+    return reader.get_pipelines()
+
+
+def jobs_from_pipelines(pipelines: List[PipelineInfo]) -> List[JobInfo]:
+    job_durations = defaultdict(list)  # type: Dict[str, List[float]]
+    overall = []
+    for pipeline in pipelines:
+        if pipeline['duration'] is not None:
+            overall.append(pipeline['duration'])
+        for job in pipeline['jobs']:
+            if job['duration'] is not None:
+                job_durations[job['name']].append(job['duration'])
+    jobs = sorted(job_durations.items())  # type: List[JobInfo]
+    # there's nothing to plot without any durations
+    if overall:
+        jobs.append(('overall', overall))
+    return jobs
+
+
 def filter_jobs(
     jobs: List[JobInfo],
     *,
@@ -55,30 +195,214 @@ def disable_sigint_handling() -> None:
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
 
-def plot_jobs(jobs: List[JobInfo], *, last: Optional[int] = None) -> None:
+def parse_timestamp(timestamp: str) -> float:
+    # Python 3.10 doesn't understand the Z suffix
+    return datetime.datetime.fromisoformat(
+        timestamp.replace('Z', '+00:00')).timestamp()
+
+
+def pipeline_bars(
+    pipeline: PipelineInfo, *, color_by: str = 'stage',
+) -> List[Bar]:
+    t0 = parse_timestamp(pipeline['created_at'])
+    bars = []
+    for job in pipeline['jobs']:
+        if not job['started_at'] or not job['finished_at']:
+            continue
+        if color_by == 'runner':
+            group = (job.get('runner') or {}).get('description') or '?'
+        else:
+            group = job['stage']
+        queued = job['created_at'] or job['started_at']
+        bars.append((
+            group,
+            job['name'],
+            parse_timestamp(queued) - t0,
+            parse_timestamp(job['started_at']) - t0,
+            parse_timestamp(job['finished_at']) - t0,
+        ))
+    bars.sort(key=lambda bar: (bar[3], bar[1]))
+    return bars
+
+
+def typical_bars(
+    pipelines: List[PipelineInfo], *, color_by: str = 'stage',
+) -> List[Bar]:
+    """Build the timeline of a typical pipeline.
+
+    Every job is placed at its median start time (relative to the start of
+    the pipeline) and takes its median duration.
+    """
+    by_name = defaultdict(list)  # type: Dict[str, List[Bar]]
+    # pipelines are newest first, so the group is taken from the newest one
+    for pipeline in pipelines:
+        for bar in pipeline_bars(pipeline, color_by=color_by):
+            by_name[bar[1]].append(bar)
+    bars = []
+    for name, job_bars in by_name.items():
+        queued = median(bar[2] for bar in job_bars)
+        started = median(bar[3] for bar in job_bars)
+        duration = median(bar[4] - bar[3] for bar in job_bars)
+        bars.append(
+            (job_bars[0][0], name, queued, started, started + duration))
+    bars.sort(key=lambda bar: (bar[3], bar[1]))
+    return bars
+
+
+def bar_collection(
+    x0: np.ndarray, x1: np.ndarray, y: np.ndarray, height: float = 0.8,
+    **kwargs: Any,
+) -> PolyCollection:
+    """Make a single artist that draws a batch of horizontal bars."""
+    verts = np.empty((len(y), 4, 2))
+    verts[:, (0, 1), 0] = x0[:, None]
+    verts[:, (2, 3), 0] = x1[:, None]
+    verts[:, (0, 3), 1] = (y - height / 2)[:, None]
+    verts[:, (1, 2), 1] = (y + height / 2)[:, None]
+    # PolyCollection accepts an (N, 4, 2) array, the type stubs disagree
+    return PolyCollection(verts, **kwargs)  # type: ignore[arg-type]
+
+
+def plot_gantt(
+    timelines: List[Tuple[str, List[Bar]]],
+    *,
+    title: str = 'Pipeline timeline (minutes)',
+) -> None:
+    fig, ax = plt.subplots()
+    ax.set_title(title, color='#808080', pad=8, fontdict=dict(fontsize=14))
+    ax.set_frame_on(False)
+    bars = []  # type: List[Bar]
+    labels = []
+    separators = []  # type: List[float]
+    for timeline_title, timeline_bars in timelines:
+        if bars:
+            separators.append(len(bars) - 0.5)
+        bars += timeline_bars
+        labels += [
+            f'{timeline_title}: {bar[1]}' if len(timelines) > 1 else bar[1]
+            for bar in timeline_bars
+        ]
+    if not bars:
+        return
+    groups = np.array([bar[0] for bar in bars])
+    queued, started, finished = (
+        np.array([bar[i] for bar in bars]) / 60.0 for i in (2, 3, 4))
+    ys = np.arange(len(bars))
+    # draw one collection for all the time spent waiting (for earlier jobs
+    # or for a free runner), and one collection per group for all the time
+    # spent running, instead of one artist per job, so we can draw thousands
+    # of jobs quickly
+    ax.add_collection(bar_collection(
+        queued, started, ys, facecolors='#dddddd', linewidths=0,
+        label='waiting'))
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    for i, group in enumerate(dict.fromkeys(groups)):
+        mask = groups == group
+        ax.add_collection(bar_collection(
+            started[mask], finished[mask], ys[mask],
+            facecolors=colors[i % len(colors)], linewidths=0, label=group))
+    for y in separators:
+        ax.axhline(y, color='#cccccc', linewidth=0.5)
+    ax.set_xlim(min(0, queued.min()), finished.max())
+    ax.set_ylim(len(bars) - 0.5, -0.5)
+    if len(bars) <= 60:
+        ax.set_yticks(ys, labels)
+    else:
+        ax.set_yticks([])
+    ax.set_axisbelow(True)
+    ax.grid(axis='x', color='#cccccc')
+    ax.tick_params(color='#ffffff', labelcolor='#808080')
+    # outside the axes, so it doesn't cover the bars; loc='best' inside
+    # would have to check every bar for overlaps, which is slow
+    ax.legend(frameon=False, loc='upper left', bbox_to_anchor=(1, 1))
+    fig.tight_layout()
+
+
+def rolling_stats(
+    ys: np.ndarray, window: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Compute a rolling median and p10-p90 band of a series.
+
+    Returns (xs, median, p10, p90), where xs are the 1-based positions of
+    the centres of the windows.
+    """
+    window = min(window, len(ys))
+    windows = sliding_window_view(ys, window)
+    p10, median, p90 = np.percentile(windows, [10, 50, 90], axis=1)
+    xs = np.arange(1, len(median) + 1) + (window - 1) / 2
+    return xs, median, p10, p90
+
+
+def step_xs(n: int) -> np.ndarray:
+    """X coordinates of a step='mid' line over builds 1..n."""
+    xs = np.arange(1, n + 1, dtype=float)
+    xs[0] -= 0.5
+    xs[-1] += 0.5
+    return xs
+
+
+def step_fill_verts(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """Outline of the area under a step='mid' line."""
+    steps = pts_to_midstep(xs, ys).T
+    return np.concatenate([[(xs[0], 0)], steps, [(xs[-1], 0)]])
+
+
+def band_verts(
+    xs: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+) -> np.ndarray:
+    """Outline of the area between two lines."""
+    return np.concatenate([
+        np.column_stack([xs, upper]),
+        np.column_stack([xs[::-1], lower[::-1]]),
+    ])
+
+
+def plot_job(
+    ax: Axes,
+    job: str,
+    durations: List[float],
+    *,
+    last: Optional[int] = None,
+    smooth: Optional[int] = None,
+    bands: bool = False,
+) -> JobArtists:
+    if last:
+        durations = durations[:last]
+    xs = step_xs(len(durations))
+    ys = np.array(durations[::-1], dtype=float) / 60.0
+    raw_alpha = 0.3 if smooth or bands else 1.0
+    [line] = ax.step(xs, ys, label=job, where='mid', alpha=raw_alpha)
+    fill = ax.fill_between(xs, ys, step='mid', alpha=0.3 * raw_alpha)
+    median_line = band = None
+    if smooth or bands:
+        sxs, median, p10, p90 = rolling_stats(ys, smooth or DEFAULT_WINDOW)
+        [median_line] = ax.plot(sxs, median, color=line.get_color(),
+                                linewidth=2)
+        if bands:
+            band = ax.fill_between(sxs, p10, p90, color=line.get_color(),
+                                   alpha=0.2, linewidth=0)
+    return (line, fill, median_line, band)
+
+
+def plot_jobs(
+    jobs: List[JobInfo],
+    *,
+    last: Optional[int] = None,
+    smooth: Optional[int] = None,
+    bands: bool = False,
+) -> Dict[str, JobArtists]:
     fig, ax = plt.subplots()
     ax.set_title('Duration of build jobs (minutes)', color='#808080',
                  pad=8, fontdict=dict(fontsize=14))
     ax.set_xlabel('builds (newest on the right)', color='#404040',
                   labelpad=16)
     ax.set_frame_on(False)
-    xmin = xmax = 1  # type: float
-    ymin = ymax = 0
-    for job, durations in jobs:
-        if last:
-            durations = durations[:last]
-        xs = list(range(1, 1 + len(durations)))  # type: List[float]
-        xmax = max(xmax, len(durations))
-        ys = [duration / 60.0 for duration in durations[::-1]]
-        ymax = max(ymax, math.ceil(max(ys)))
-        xs[0] -= 0.5
-        xs[-1] += 0.5
-        ax.step(xs, ys, label=job, where='mid')
-        ax.fill_between(xs, ys, step='mid', alpha=0.3)
-    xmin -= 0.5
-    xmax += 0.5
-    ax.set_xlim(xmin=xmin, xmax=xmax)
-    ax.set_ylim(ymin=ymin)
+    artists = {
+        job: plot_job(ax, job, durations, last=last, smooth=smooth,
+                      bands=bands)
+        for job, durations in jobs
+    }
+    set_job_limits(ax, jobs, last=last)
     ax.xaxis.set_major_locator(plt.MaxNLocator(nbins=20, integer=True))
     ax.set_axisbelow(True)
     ax.grid(axis='y', color='#cccccc')
@@ -88,8 +412,144 @@ def plot_jobs(jobs: List[JobInfo], *, last: Optional[int] = None) -> None:
     # the tick at y=0 is not aligned with the gridline at y=0, so we make the
     # ticks invisible
     ax.tick_params(color='#ffffff', labelcolor='#808080', labelbottom=False)
-    ax.legend(frameon=False)
-    plt.show()
+    if artists:
+        ax.legend(frameon=False)
+    return artists
+
+
+def set_job_limits(
+    ax: Axes, jobs: List[JobInfo], *, last: Optional[int] = None,
+) -> bool:
+    """Fit the axes of a plot_jobs() chart to the data.
+
+    Returns True if the limits changed.
+    """
+    xmax = max([1] + [len(durations[:last]) for job, durations in jobs])
+    ymax = max([0] + [
+        max(durations[:last]) / 60.0 for job, durations in jobs if durations
+    ])
+    changed = False
+    if ax.get_xlim() != (0.5, xmax + 0.5):
+        ax.set_xlim(0.5, xmax + 0.5)
+        changed = True
+    if ax.get_ylim()[0] != 0:
+        ax.set_ylim(ymin=0)
+        changed = True
+    if ax.get_ylim()[1] < ymax:
+        ax.set_ylim(ymax=math.ceil(ymax))
+        changed = True
+    return changed
+
+
+def update_jobs(
+    artists: Dict[str, JobArtists],
+    jobs: List[JobInfo],
+    *,
+    last: Optional[int] = None,
+    smooth: Optional[int] = None,
+) -> None:
+    """Update the artists of a plot_jobs() chart with new data in place."""
+    new_data = dict(jobs)
+    for job, (line, fill, median_line, band) in artists.items():
+        durations = new_data.get(job)
+        if not durations:
+            # the job is gone from the last builds
+            for artist in line, median_line:
+                if artist is not None:
+                    artist.set_data([], [])
+            for collection in fill, band:
+                if collection is not None:
+                    collection.set_verts([])
+            continue
+        if last:
+            durations = durations[:last]
+        xs = step_xs(len(durations))
+        ys = np.array(durations[::-1], dtype=float) / 60.0
+        line.set_data(xs, ys)
+        fill.set_verts([step_fill_verts(xs, ys)])
+        if median_line is not None:
+            sxs, median, p10, p90 = rolling_stats(
+                ys, smooth or DEFAULT_WINDOW)
+            median_line.set_data(sxs, median)
+            if band is not None:
+                band.set_verts([band_verts(sxs, p10, p90)])
+
+
+def follow_jobs(
+    fig: Figure,
+    ax: Axes,
+    load: Callable[[], Optional[List[JobInfo]]],
+    artists: Dict[str, JobArtists],
+    *,
+    interval: float,
+    last: Optional[int] = None,
+    smooth: Optional[int] = None,
+    bands: bool = False,
+) -> FuncAnimation:
+    """Keep a plot_jobs() chart up to date with new data.
+
+    ``load`` is called every ``interval`` seconds and returns new data, or
+    None if nothing changed.  Only the data artists are redrawn (blitted),
+    unless new jobs show up or the axes need to grow.
+    """
+
+    def update(frame: int) -> List[Artist]:
+        jobs = load()
+        if jobs is not None:
+            update_jobs(artists, jobs, last=last, smooth=smooth)
+            redraw = set_job_limits(ax, jobs, last=last)
+            for job, durations in jobs:
+                if job not in artists and durations:
+                    artists[job] = plot_job(ax, job, durations, last=last,
+                                            smooth=smooth, bands=bands)
+                    ax.legend(frameon=False)
+                    redraw = True
+            if redraw:
+                # blitting redraws only the artists, not the ticks or the
+                # legend
+                fig.canvas.draw()
+        return [
+            artist for job_artists in artists.values()
+            for artist in job_artists if artist is not None
+        ]
+
+    # without cache_frame_data=False it would remember every frame it ever
+    # drew
+    return FuncAnimation(fig, update, interval=interval * 1000,
+                         blit=True, cache_frame_data=False)
+
+
+def csv_loader(filename: str) -> Callable[[], Optional[List[JobInfo]]]:
+    # gitlab-jobs rewrites the whole CSV file (new builds are added at the
+    # start of each row), so there's nothing to gain from reading only the
+    # new bytes; instead, reload it only when it changes
+    last_seen = None
+
+    def load() -> Optional[List[JobInfo]]:
+        nonlocal last_seen
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == last_seen:
+            return None
+        last_seen = (st.st_ino, st.st_size, st.st_mtime_ns)
+        return load_csv(filename)
+
+    return load
+
+
+def jsonl_loader(
+    filename: str, *, keep: Optional[int] = None,
+) -> Callable[[], Optional[List[JobInfo]]]:
+    reader = JsonlReader(filename, keep=keep)
+
+    def load() -> Optional[List[JobInfo]]:
+        if not reader.poll():
+            return None
+        return jobs_from_pipelines(reader.get_pipelines())
+
+    return load
 
 
 def main() -> None:
@@ -102,7 +562,9 @@ def main() -> None:
         "filename",
         help=(
             "CSV file to load; each row should have a job name followed by"
-            " a series of durations in seconds (newest builds first)"
+            " a series of durations in seconds (newest builds first); or a"
+            " .jsonl file written by gitlab-jobs --jsonl or gitlab-jobs"
+            " ingest"
         ),
     )
     parser.add_argument(
@@ -120,9 +582,77 @@ def main() -> None:
         "-l", "--last", metavar='N', type=int,
         help="Limit the graph to the last N jobs (default: unlimited)",
     )
+    parser.add_argument(
+        "--smooth", metavar='WINDOW', type=int,
+        help=(
+            "Overlay a rolling median over WINDOW builds for each job"
+        ),
+    )
+    parser.add_argument(
+        "--bands", action='store_true',
+        help=(
+            "Overlay a rolling p10-p90 band for each job (over the --smooth"
+            f" window, default: {DEFAULT_WINDOW} builds)"
+        ),
+    )
+    parser.add_argument(
+        "--gantt", metavar='PIPELINE_ID', nargs='*', type=int,
+        help=(
+            "Draw a timeline of the jobs in the given pipelines (default:"
+            " the newest pipeline, or the newest N pipelines with --last N);"
+            " needs a .jsonl file"
+        ),
+    )
+    parser.add_argument(
+        "--typical", action='store_true',
+        help=(
+            "Draw a timeline of a typical pipeline, using median job start"
+            " times and durations; needs a .jsonl file"
+        ),
+    )
+    parser.add_argument(
+        "--color-by", choices=['stage', 'runner'], default='stage',
+        help="How to color the jobs in a timeline (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-f", "--follow", action='store_true',
+        help=(
+            "Keep watching the file and update the graph when new data gets"
+            " written to it (use --last N to keep memory use bounded)"
+        ),
+    )
+    parser.add_argument(
+        "--interval", metavar='SECONDS', type=float, default=5,
+        help="How often to check for new data with --follow"
+             " (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o", "--output", metavar='FILENAME',
+        help="Save the graph to a file (e.g. .png or .svg) instead of"
+             " showing it",
+    )
     args = parser.parse_args()
+    if args.smooth is not None and args.smooth < 1:
+        parser.error("--smooth window must be a positive number")
+    is_jsonl = args.filename.endswith('.jsonl')
+    if (args.gantt is not None or args.typical) and not is_jsonl:
+        parser.error("--gantt and --typical need a .jsonl file")
+    if args.follow and (args.gantt is not None or args.typical
+                        or args.output):
+        parser.error("--follow cannot be used with --gantt, --typical or"
+                     " --output")
 
-    jobs = load_csv(args.filename)
+    if args.follow:
+        if is_jsonl:
+            load = jsonl_loader(args.filename, keep=args.last)
+        else:
+            load = csv_loader(args.filename)
+        jobs = load() or []
+    elif is_jsonl:
+        pipelines = load_jsonl(args.filename)
+        jobs = jobs_from_pipelines(pipelines)
+    else:
+        jobs = load_csv(args.filename)
 
     filtered_jobs = filter_jobs(
         jobs, select=args.jobs, exclude=args.exclude_jobs)
@@ -132,9 +662,62 @@ def main() -> None:
             print(f"  {job_name}")
         sys.exit(1)
 
-    disable_sigint_handling()
+    if args.output:
+        plt.switch_backend('agg')
+    else:
+        disable_sigint_handling()
+
+    job_names = {job_name for job_name, durations in filtered_jobs}
+    if args.gantt is not None:
+        if args.gantt:
+            wanted = set(args.gantt)
+            pipelines = [p for p in pipelines if p['id'] in wanted]
+            missing = wanted - {p['id'] for p in pipelines}
+            if missing:
+                print(f"No such pipeline in {args.filename}: "
+                      + ", ".join(map(str, sorted(missing))))
+                sys.exit(1)
+        else:
+            pipelines = pipelines[:args.last or 1]
+        plot_gantt([
+            (str(pipeline['id']), [
+                bar for bar in pipeline_bars(pipeline, color_by=args.color_by)
+                if bar[1] in job_names
+            ])
+            for pipeline in pipelines[::-1]
+        ])
+    elif args.typical:
+        pipelines = pipelines[:args.last]
+        plot_gantt([('', [
+            bar for bar in typical_bars(pipelines, color_by=args.color_by)
+            if bar[1] in job_names
+        ])], title=(
+            f'Typical pipeline timeline (median of {len(pipelines)},'
+            ' minutes)'
+        ))
+    else:
+        artists = plot_jobs(filtered_jobs, last=args.last,
+                            smooth=args.smooth, bands=args.bands)
+
+    if args.follow:
+
+        def load_filtered() -> Optional[List[JobInfo]]:
+            jobs = load()
+            if jobs is None:
+                return None
+            return filter_jobs(
+                jobs, select=args.jobs, exclude=args.exclude_jobs)
+
+        # keep a reference, or the animation gets garbage-collected
+        animation = follow_jobs(  # noqa: F841
+            plt.gcf(), plt.gca(), load_filtered, artists,
+            interval=args.interval, last=args.last, smooth=args.smooth,
+            bands=args.bands)
 
-    plot_jobs(filtered_jobs, last=args.last)
+    if args.output:
+        plt.savefig(args.output)
+    else:
+        plt.show()
 
 
 if __name__ == "__main__":
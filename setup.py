@@ -52,6 +52,7 @@ setup(
     install_requires=[
         'python-gitlab',
         'colorama',
+        'requests',
     ],
     entry_points={
         'console_scripts': [
@@ -0,0 +1,221 @@
+import json
+import os
+import textwrap
+
+import pytest
+
+
+graph = pytest.importorskip('graph')
+
+
+def PipelineRecord(id, duration=60, jobs=()):
+    return dict(
+        kind='pipeline',
+        id=id,
+        created_at='2020-04-29T08:00:00Z',
+        duration=duration,
+        jobs=list(jobs),
+    )
+
+
+def JobRecord(id, name='tests', stage='test', duration=30,
+              created_at='2020-04-29T08:00:00Z',
+              started_at='2020-04-29T08:00:10Z',
+              finished_at='2020-04-29T08:00:40Z', runner=None):
+    return dict(
+        kind='job',
+        id=id,
+        name=name,
+        stage=stage,
+        duration=duration,
+        created_at=created_at,
+        started_at=started_at,
+        finished_at=finished_at,
+        runner=runner,
+    )
+
+
+def write_records(filename, records, mode='w'):
+    with open(filename, mode) as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def pipeline_ids(reader):
+    return [pipeline['id'] for pipeline in reader.get_pipelines()]
+
+
+def test_jsonl_reader_missing_file(tmp_path):
+    reader = graph.JsonlReader(str(tmp_path / 'store.jsonl'))
+    assert not reader.poll()
+    assert reader.get_pipelines() == []
+
+
+def test_jsonl_reader_appends(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [PipelineRecord(1)])
+    reader = graph.JsonlReader(str(store))
+    assert reader.poll()
+    assert pipeline_ids(reader) == [1]
+    assert not reader.poll()
+    write_records(store, [
+        PipelineRecord(2),
+        dict(JobRecord(20), pipeline_id=2),
+    ], mode='a')
+    assert reader.poll()
+    assert pipeline_ids(reader) == [2, 1]
+    assert reader.get_pipelines()[0]['jobs'][0]['id'] == 20
+
+
+def test_jsonl_reader_partial_line(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    line = json.dumps(PipelineRecord(1)) + '\n'
+    store.write_text(line[:10])
+    reader = graph.JsonlReader(str(store))
+    reader.poll()
+    assert pipeline_ids(reader) == []
+    with open(store, 'a') as f:
+        f.write(line[10:])
+    reader.poll()
+    assert pipeline_ids(reader) == [1]
+
+
+def test_jsonl_reader_truncated(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [PipelineRecord(1), PipelineRecord(2)])
+    reader = graph.JsonlReader(str(store))
+    reader.poll()
+    write_records(store, [PipelineRecord(3)])
+    reader.poll()
+    assert pipeline_ids(reader) == [3]
+
+
+def test_jsonl_reader_replaced(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [PipelineRecord(1)])
+    reader = graph.JsonlReader(str(store))
+    reader.poll()
+    write_records(tmp_path / 'new.jsonl', [PipelineRecord(2)])
+    os.replace(tmp_path / 'new.jsonl', store)
+    reader.poll()
+    assert pipeline_ids(reader) == [2]
+
+
+def test_jsonl_reader_rewritten_in_place(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [PipelineRecord(id) for id in range(1, 21)])
+    reader = graph.JsonlReader(str(store))
+    reader.poll()
+    write_records(store, [PipelineRecord(id) for id in range(2, 23)])
+    reader.poll()
+    assert pipeline_ids(reader) == list(range(22, 1, -1))
+
+
+def test_jsonl_reader_keep(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [
+        PipelineRecord(id, jobs=[JobRecord(id * 10)]) for id in range(1, 6)
+    ])
+    reader = graph.JsonlReader(str(store), keep=2)
+    reader.poll()
+    assert pipeline_ids(reader) == [5, 4]
+    assert sorted(reader.jobs) == [4, 5]
+
+
+def test_load_jsonl_unterminated_line(tmp_path):
+    store = tmp_path / 'store.jsonl'
+    store.write_text(json.dumps(PipelineRecord(1)))
+    assert [pipeline['id'] for pipeline in graph.load_jsonl(str(store))] == [1]
+
+
+def test_jobs_from_pipelines():
+    pipelines = [
+        PipelineRecord(2, duration=None, jobs=[JobRecord(20, duration=None)]),
+        PipelineRecord(1, duration=60, jobs=[JobRecord(10, duration=30)]),
+    ]
+    assert graph.jobs_from_pipelines(pipelines) == [
+        ('tests', [30]),
+        ('overall', [60]),
+    ]
+
+
+def test_jobs_from_pipelines_without_durations():
+    pipelines = [PipelineRecord(1, duration=None)]
+    assert graph.jobs_from_pipelines(pipelines) == []
+
+
+def test_main_without_durations(tmp_path, monkeypatch):
+    store = tmp_path / 'store.jsonl'
+    write_records(store, [PipelineRecord(1, duration=None)])
+    monkeypatch.setattr('sys.argv', [
+        'graph.py', str(store), '-o', str(tmp_path / 'graph.png')])
+    graph.main()
+    assert (tmp_path / 'graph.png').exists()
+
+
+def test_rolling_stats():
+    xs, median, p10, p90 = graph.rolling_stats(
+        graph.np.array([1.0, 2.0, 3.0, 4.0, 5.0]), 3)
+    assert list(xs) == [2, 3, 4]
+    assert list(median) == [2, 3, 4]
+    assert list(p10) == pytest.approx([1.2, 2.2, 3.2])
+    assert list(p90) == pytest.approx([2.8, 3.8, 4.8])
+
+
+def test_rolling_stats_short_series():
+    xs, median, p10, p90 = graph.rolling_stats(
+        graph.np.array([1.0, 3.0]), 10)
+    assert list(xs) == [1.5]
+    assert list(median) == [2]
+
+
+def test_pipeline_bars():
+    pipeline = PipelineRecord(1, jobs=[
+        JobRecord(12, name='tests', stage='test',
+                  created_at='2020-04-29T08:00:00Z',
+                  started_at='2020-04-29T08:01:00Z',
+                  finished_at='2020-04-29T08:02:00Z',
+                  runner=dict(id=1, description='docker-1')),
+        JobRecord(11, name='build', stage='build', created_at=None,
+                  started_at='2020-04-29T08:00:10Z',
+                  finished_at='2020-04-29T08:00:50Z'),
+        JobRecord(13, name='deploy', stage='deploy', started_at=None,
+                  finished_at=None),
+    ])
+    assert graph.pipeline_bars(pipeline) == [
+        ('build', 'build', 10, 10, 50),
+        ('test', 'tests', 0, 60, 120),
+    ]
+    assert graph.pipeline_bars(pipeline, color_by='runner') == [
+        ('?', 'build', 10, 10, 50),
+        ('docker-1', 'tests', 0, 60, 120),
+    ]
+
+
+def test_typical_bars():
+    pipelines = [
+        PipelineRecord(id, jobs=[
+            JobRecord(id * 10, name='tests',
+                      started_at='2020-04-29T08:00:{:02}Z'.format(start),
+                      finished_at='2020-04-29T08:01:{:02}Z'.format(end)),
+        ])
+        for id, start, end in [(3, 10, 10), (2, 20, 40), (1, 30, 0)]
+    ]
+    assert graph.typical_bars(pipelines) == [
+        ('test', 'tests', 0, 20, 80),
+    ]
+
+
+def test_csv_loader(tmp_path):
+    jobs_csv = tmp_path / 'jobs.csv'
+    load = graph.csv_loader(str(jobs_csv))
+    assert load() is None
+    jobs_csv.write_text(textwrap.dedent('''\
+        tests,15,16.5
+
+        overall,38
+    '''))
+    assert load() == [('tests', [15.0, 16.5]), ('overall', [38.0])]
+    assert load() is None
+    jobs_csv.write_text('overall,38,40\n')
+    assert load() == [('overall', [38.0, 40.0])]
@@ -1,7 +1,15 @@
+import argparse
 import hashlib
+import http.client
+import json
+import math
+import random
 import subprocess
 import sys
 import textwrap
+import threading
+import urllib.error
+import urllib.request
 from unittest.mock import MagicMock, Mock, call
 
 import gitlab
@@ -188,6 +196,7 @@ def Job(
     runner_online=True,
     runner_status="online",
     artifacts_expire_at=None,
+    tag_list=(),
     project_id=42,
 ):
     attributes = dict(
@@ -266,6 +275,7 @@ def Job(
             status=runner_status,
         ),
         artifacts_expire_at=artifacts_expire_at,
+        tag_list=list(tag_list),
         project_id=project_id,
         pipeline_id=pipeline_id,
     )
@@ -531,3 +541,1698 @@ def test_main_some_pipelines_csv_export(
       tests,16.589658
       overall,38
     ''')
+
+
+def test_read_csv_missing_file(tmp_path):
+    assert glj.read_csv(str(tmp_path / "jobs.csv")) == {}
+
+
+def test_read_csv_index_missing_file(tmp_path):
+    assert glj.read_csv_index(str(tmp_path / "jobs.csv")) == []
+
+
+def test_append_csv(tmp_path):
+    jobs_csv = tmp_path / "jobs.csv"
+    jobs_csv.write_text(textwrap.dedent('''\
+      build,30.5,31
+      tests,16.589658,17
+
+      overall,38,40
+    '''))
+    (tmp_path / "jobs.csv.pipelines").write_text('2\n1\n')
+    glj.append_csv(str(jobs_csv), {
+        'tests': [15],
+        'lint': [5, 6],
+        'overall': [35, 36],
+    }, [4, 3])
+    assert jobs_csv.read_text() == textwrap.dedent('''\
+      build,30.5,31
+      lint,5,6
+      tests,15,16.589658,17
+      overall,35,36,38,40
+    ''')
+    assert (tmp_path / "jobs.csv.pipelines").read_text() == '4\n3\n2\n1\n'
+
+
+def test_main_some_pipelines_append_csv(
+    set_argv, set_pipelines, set_git_remote_url, capsys, tmp_path
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '--append-csv', str(jobs_csv)])
+    set_git_remote_url('https://gitlab.com/mgedmin/example-project')
+    set_pipelines([
+        Pipeline(id=3, jobs=[
+            Job(id=1003, duration=15),
+        ]),
+        Pipeline(id=2, jobs=[
+            Job(id=1002),
+        ]),
+        Pipeline(id=1, jobs=[
+            Job(id=1001),
+        ]),
+    ])
+    jobs_csv.write_text(textwrap.dedent('''\
+      tests,16.589658
+      overall,38
+    '''))
+    (tmp_path / "jobs.csv.pipelines").write_text('2\n')
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_csv), '/tmp/jobs.csv')
+    assert stdout == textwrap.dedent('''\
+        Determined the GitLab project to be mgedmin/example-project
+        1 new successful pipelines of example-project master:
+          3 (2020-04-29, commit 77de68da, duration 0.6m)
+
+        Summary:
+          tests    min  0.2m, max  0.2m, avg  0.2m, median  0.2m, stdev  0.0m
+          overall  min  0.6m, max  0.6m, avg  0.6m, median  0.6m, stdev  0.0m
+
+        Updating /tmp/jobs.csv...
+    ''')
+    assert jobs_csv.read_text() == textwrap.dedent('''\
+      tests,15,16.589658
+      overall,38,38
+    ''')
+    assert (tmp_path / "jobs.csv.pipelines").read_text() == (
+        '# updated_at 2020-04-29T08:32:14.375Z\n3\n2\n')
+
+
+def test_main_append_csv_new_pipelines_without_duration(
+    set_argv, set_pipelines, set_git_remote_url, capsys, tmp_path
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '--append-csv', str(jobs_csv)])
+    set_git_remote_url('https://gitlab.com/mgedmin/example-project')
+    set_pipelines([
+        Pipeline(id=1, duration=None),
+    ])
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_csv), '/tmp/jobs.csv')
+    assert stdout == textwrap.dedent('''\
+        Determined the GitLab project to be mgedmin/example-project
+        Last 20 successful pipelines of example-project master:
+          1 (2020-04-29, commit 356a192b)
+
+        No finished pipelines found.
+
+        Updating /tmp/jobs.csv...
+    ''')
+    assert jobs_csv.read_text() == ''
+    assert (tmp_path / "jobs.csv.pipelines").read_text() == (
+        '# updated_at 2020-04-29T08:32:14.375Z\n1\n')
+
+
+def test_main_append_csv_up_to_date(
+    set_argv, set_pipelines, set_git_remote_url, capsys, tmp_path
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '--append-csv', str(jobs_csv)])
+    set_git_remote_url('https://gitlab.com/mgedmin/example-project')
+    set_pipelines([
+        Pipeline(id=1),
+    ])
+    (tmp_path / "jobs.csv.pipelines").write_text('1\n')
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Determined the GitLab project to be mgedmin/example-project
+        0 new successful pipelines of example-project master:
+
+        No finished pipelines found.
+    ''')
+    assert not jobs_csv.exists()
+
+
+def test_main_append_csv_out_of_order(
+    set_argv, set_pipelines, gitlab_project, capsys, tmp_path
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '-l', '1',
+              '--append-csv', str(jobs_csv)])
+    # pipeline 2 finished after pipeline 3 was recorded; pipelines are
+    # listed by the time of their last update, and --limit doesn't apply
+    set_pipelines([
+        Pipeline(id=4, duration=60),
+        Pipeline(id=2, duration=120),
+        Pipeline(id=3),
+        Pipeline(id=1),
+    ])
+    (tmp_path / "jobs.csv.pipelines").write_text('3\n1\n')
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_csv), '/tmp/jobs.csv')
+    assert stdout == textwrap.dedent('''\
+        2 new successful pipelines of example-project master:
+          4 (2020-04-29, commit 1b645389, duration 1.0m)
+          2 (2020-04-29, commit da4b9237, duration 2.0m)
+
+        Summary:
+          overall  min  1.0m, max  2.0m, avg  1.5m, median  1.5m, stdev  0.7m
+
+        Updating /tmp/jobs.csv...
+    ''')
+    assert (tmp_path / "jobs.csv.pipelines").read_text() == (
+        '# updated_at 2020-04-29T08:32:14.375Z\n4\n2\n3\n1\n')
+    gitlab_project.pipelines.list.assert_called_once_with(
+        iterator=True, per_page=100, order_by='updated_at', sort='desc',
+        ref='master', scope='finished', status='success')
+
+
+def test_main_append_csv_without_index(set_argv, capsys, tmp_path):
+    jobs_csv = tmp_path / "jobs.csv"
+    jobs_csv.write_text('overall,38\n')
+    set_argv(['gitlab-jobs', '--append-csv', str(jobs_csv)])
+    with pytest.raises(SystemExit):
+        glj.main()
+    assert 'jobs.csv.pipelines is missing' in capsys.readouterr().err
+    assert jobs_csv.read_text() == 'overall,38\n'
+
+
+def test_main_append_csv_known_pipeline_updated_again(
+    set_argv, set_pipelines, gitlab_project, capsys, tmp_path
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--append-csv', str(jobs_csv)])
+    # a manual job in pipeline 1 bumped its updated_at after pipeline 2
+    # finished; pipeline 0 was seen by the previous run
+    set_pipelines([
+        Pipeline(id=1, updated_at="2020-04-30T10:00:00.000Z"),
+        Pipeline(id=2, updated_at="2020-04-30T09:00:00.000Z", duration=60),
+        Pipeline(id=0, updated_at="2020-04-29T08:32:14.375Z"),
+    ])
+    jobs_csv.write_text('overall,38\n')
+    (tmp_path / "jobs.csv.pipelines").write_text(
+        '# updated_at 2020-04-29T08:32:14.375Z\n1\n')
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_csv), '/tmp/jobs.csv')
+    assert stdout == textwrap.dedent('''\
+        1 new successful pipelines of example-project master:
+          2 (2020-04-29, commit da4b9237, duration 1.0m)
+
+        Summary:
+          overall  min  1.0m, max  1.0m, avg  1.0m, median  1.0m, stdev  0.0m
+
+        Updating /tmp/jobs.csv...
+    ''')
+    assert jobs_csv.read_text() == 'overall,60,38\n'
+    assert (tmp_path / "jobs.csv.pipelines").read_text() == (
+        '# updated_at 2020-04-30T09:00:00.000Z\n2\n1\n')
+
+
+def test_get_new_pipelines_stops_at_watermark(gitlab_project):
+    gitlab_project.pipelines.list.return_value = [
+        Pipeline(id=3, updated_at="2020-04-30T10:00:00.000Z"),
+        Pipeline(id=2, updated_at="2020-04-29T08:32:14.375Z"),
+        Pipeline(id=4, updated_at="2020-04-29T08:00:00.000Z"),
+    ]
+    args = glj.parser.parse_args([])
+    pipelines = glj.get_new_pipelines(
+        gitlab_project, args, {1}, "2020-04-29T08:32:14.375Z")
+    assert [pipeline.id for pipeline in pipelines] == [3, 2]
+
+
+def test_get_new_pipelines_without_watermark(gitlab_project):
+    gitlab_project.pipelines.list.return_value = [
+        Pipeline(id=3), Pipeline(id=2), Pipeline(id=1), Pipeline(id=4),
+    ]
+    args = glj.parser.parse_args([])
+    pipelines = glj.get_new_pipelines(gitlab_project, args, {2}, None)
+    assert [pipeline.id for pipeline in pipelines] == [4, 3]
+
+
+def test_read_csv_watermark_missing_file(tmp_path):
+    assert glj.read_csv_watermark(str(tmp_path / "jobs.csv")) is None
+
+
+def test_read_csv_watermark_old_index(tmp_path):
+    (tmp_path / "jobs.csv.pipelines").write_text('2\n1\n')
+    assert glj.read_csv_watermark(str(tmp_path / "jobs.csv")) is None
+
+
+TRACE = (
+    b'\x1b[0Ksection_start:1560896352:prepare_executor\r\x1b[0KPreparing\n'
+    b'Using Docker executor\n'
+    b'\x1b[0Ksection_end:1560896364:prepare_executor\r\x1b[0K\n'
+    b'\x1b[0Ksection_start:1560896364:step_script[collapsed=true]\r\x1b[0K\n'
+    b'$ make test\n'
+    b'\x1b[0Ksection_end:1560896424:step_script\r\x1b[0K\n'
+    b'\x1b[0Ksection_end:1560896424:never_started\r\x1b[0K\n'
+)
+
+
+def test_parse_sections():
+    assert glj.parse_sections([TRACE]) == {
+        'prepare_executor': 12,
+        'step_script': 60,
+    }
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64])
+def test_parse_sections_in_small_chunks(chunk_size):
+    chunks = [
+        TRACE[i:i + chunk_size] for i in range(0, len(TRACE), chunk_size)
+    ]
+    assert glj.parse_sections(chunks) == {
+        'prepare_executor': 12,
+        'step_script': 60,
+    }
+
+
+def test_parse_sections_repeated():
+    trace = (
+        b'section_start:10:cache\r\nsection_end:15:cache\r\n'
+        b'section_start:20:cache\r\nsection_end:22:cache\r\n'
+    )
+    assert glj.parse_sections([trace]) == {'cache': 7}
+
+
+def test_get_cache_dir(monkeypatch):
+    args = glj.parser.parse_args([])
+    monkeypatch.setenv('XDG_CACHE_HOME', '/var/cache')
+    assert glj.get_cache_dir(args) == '/var/cache/gitlab-jobs'
+    args = glj.parser.parse_args(['--cache-dir', '/tmp/cache'])
+    assert glj.get_cache_dir(args) == '/tmp/cache'
+
+
+def test_iter_trace_caches_finished_jobs(gitlab_project, tmp_path):
+    job = Job(id=1001)
+    trace = gitlab_project.jobs.get.return_value.trace
+    trace.return_value = iter([b'hello ', b'world\n'])
+    chunks = glj.iter_trace(gitlab_project, job, str(tmp_path))
+    assert b''.join(chunks) == b'hello world\n'
+    cached = tmp_path / 'traces' / '42' / '1001.log'
+    assert cached.read_bytes() == b'hello world\n'
+    trace.assert_called_once_with(
+        streamed=True, iterator=True, chunk_size=glj.CHUNK_SIZE)
+    trace.return_value = iter([b'not used'])
+    chunks = glj.iter_trace(gitlab_project, job, str(tmp_path))
+    assert b''.join(chunks) == b'hello world\n'
+
+
+def test_iter_trace_does_not_cache_running_jobs(gitlab_project, tmp_path):
+    job = Job(id=1001, status='running')
+    trace = gitlab_project.jobs.get.return_value.trace
+    trace.return_value = iter([b'hello ', b'world\n'])
+    chunks = glj.iter_trace(gitlab_project, job, str(tmp_path))
+    assert b''.join(chunks) == b'hello world\n'
+    assert not (tmp_path / 'traces').exists()
+
+
+@pytest.mark.parametrize('values, p, expected', [
+    ([5], 95, 5),
+    ([1, 2, 3, 4, 5], 50, 3),
+    ([5, 4, 3, 2, 1], 95, 4.8),
+    ([1, 2], 100, 2),
+])
+def test_percentile(values, p, expected):
+    assert glj.percentile(values, p) == pytest.approx(expected)
+
+
+def test_main_some_pipelines_sections(
+    set_argv, set_pipelines, set_git_remote_url, gitlab_project, capsys,
+    tmp_path,
+):
+    set_argv(['gitlab-jobs', '--sections', '--cache-dir', str(tmp_path)])
+    set_git_remote_url('https://gitlab.com/mgedmin/example-project')
+    set_pipelines([
+        Pipeline(id=2, jobs=[
+            Job(id=1002),
+            Job(id=1003, name='lint'),
+        ]),
+        Pipeline(id=1, jobs=[
+            Job(id=1001),
+        ]),
+    ])
+    traces = {
+        1001: [TRACE],
+        1002: [TRACE.replace(b'1560896424', b'1560896484')],
+        1003: [b'no sections here\n'],
+    }
+    gitlab_project.jobs.get = lambda id, lazy: Mock(
+        trace=Mock(return_value=iter(traces[id])))
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Determined the GitLab project to be mgedmin/example-project
+        Last 20 successful pipelines of example-project master:
+          2 (2020-04-29, commit da4b9237, duration 0.6m)
+          1 (2020-04-29, commit 356a192b, duration 0.6m)
+
+        Summary:
+          lint     min  0.3m, max  0.3m, avg  0.3m, median  0.3m, stdev  0.0m
+          tests    min  0.3m, max  0.3m, avg  0.3m, median  0.3m, stdev  0.0m
+          overall  min  0.6m, max  0.6m, avg  0.6m, median  0.6m, stdev  0.0m
+
+        Sections:
+          tests
+            prepare_executor  min  0.2m, median  0.2m, p95  0.2m
+            step_script       min  1.0m, median  1.5m, p95  1.9m
+    ''')
+
+
+@pytest.mark.parametrize('xs, ys, expected', [
+    ([1, 2, 3, 4, 5], [6, 7, 8, 9, 10], 0.0122),
+    ([1, 2, 3, 4, 5], [1, 2, 3, 4, 5], 1.0),
+    ([1, 1, 2, 2, 3], [2, 3, 3, 4, 4], 0.0524),
+    ([1], [1], 1.0),
+])
+def test_mann_whitney_u(xs, ys, expected):
+    assert glj.mann_whitney_u(xs, ys) == pytest.approx(expected, abs=1e-4)
+
+
+def test_main_compare(set_argv, gitlab_project, capsys):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--compare', 'master', 'feature'])
+    master = [
+        Pipeline(id=i, duration=600 + i, jobs=[
+            Job(id=100 + i, name='tests', duration=300 + i),
+            Job(id=200 + i, name='lint', duration=60 + i),
+            Job(id=300 + i, name='docs', duration=120),
+        ])
+        for i in range(1, 7)
+    ]
+    feature = [
+        Pipeline(id=i, duration=590 + i, jobs=[
+            Job(id=100 + i, name='tests', duration=360 + i),
+            Job(id=200 + i, name='lint', duration=60 - i),
+            Job(id=400 + i, name='build', duration=100),
+        ])
+        for i in range(11, 17)
+    ] + [
+        Pipeline(id=10, duration=600, jobs=[
+            Job(id=110, name='lint', duration=30),
+        ]),
+    ]
+    pipelines = {'master': master, 'feature': feature}
+    gitlab_project.pipelines.list = (
+        lambda ref, page, per_page, **kw: pipelines[ref])
+    gitlab_project.pipelines.get = {
+        pipeline.id: pipeline for pipeline in master + feature
+    }.get
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Comparing last 20 successful pipelines of example-project master\
+ and feature:
+
+          build    only in feature
+          docs     only in master
+          lint     median  1.1m vs  0.8m, diff -0.3m, adjusted p=0.010 - faster
+          tests    median  5.1m vs  6.2m, diff +1.2m, adjusted p=0.010 - slower
+          overall  median 10.1m vs 10.1m, diff +0.0m, adjusted p=0.719
+    ''')
+
+
+@pytest.mark.parametrize('option', [
+    '--csv=jobs.csv', '--append-csv=jobs.csv', '--jsonl=jobs.jsonl',
+    '--cost', '--artifacts', '--sections', '--summary-every=5', '--progress',
+])
+def test_main_compare_rejects_other_outputs(set_argv, capsys, option):
+    set_argv(['gitlab-jobs', '--compare', 'master', 'feature', option])
+    with pytest.raises(SystemExit):
+        glj.main()
+    assert '--compare cannot be used with {}'.format(
+        option.partition('=')[0]) in capsys.readouterr().err
+
+
+def test_holm_bonferroni():
+    assert glj.holm_bonferroni([]) == []
+    assert glj.holm_bonferroni([0.01, 0.04, 0.03, 0.5]) == pytest.approx(
+        [0.04, 0.09, 0.09, 0.5])
+    assert glj.holm_bonferroni([0.5, 0.9]) == [1.0, 1.0]
+
+
+def test_main_compare_many_identical_jobs(set_argv, gitlab_project, capsys):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--compare', 'master', 'feature'])
+    # all durations come from the same distribution; without correcting
+    # for multiple comparisons two of these jobs would be flagged
+    rng = random.Random(0)
+    pipelines = {
+        ref: [
+            Pipeline(id=id, duration=600, jobs=[
+                Job(id=id * 100 + j, name='job{:02}'.format(j),
+                    duration=rng.randint(60, 120))
+                for j in range(30)
+            ])
+            for id in ids
+        ]
+        for ref, ids in [('master', range(1, 11)), ('feature', range(11, 21))]
+    }
+    gitlab_project.pipelines.list = (
+        lambda ref, page, per_page, **kw: pipelines[ref])
+    gitlab_project.pipelines.get = {
+        pipeline.id: pipeline
+        for pipeline in pipelines['master'] + pipelines['feature']
+    }.get
+    glj.main()
+    stdout = capsys.readouterr().out
+    assert 'job29' in stdout
+    assert 'faster' not in stdout
+    assert 'slower' not in stdout
+
+
+def PipelineHook(
+    id=31,
+    status='success',
+    ref='master',
+    duration=63,
+    builds=(),
+):
+    return {
+        "object_kind": "pipeline",
+        "object_attributes": {
+            "id": id,
+            "iid": 3,
+            "ref": ref,
+            "tag": False,
+            "sha": hashlib.sha1(str(id).encode()).hexdigest(),
+            "source": "push",
+            "status": status,
+            "stages": ["build", "test"],
+            "created_at": "2016-08-12 15:23:28 UTC",
+            "finished_at": "2016-08-12 15:26:29 UTC",
+            "duration": duration,
+        },
+        "user": {"id": 1, "name": "Administrator", "username": "root"},
+        "project": {
+            "id": 42,
+            "name": "example-project",
+            "path_with_namespace": "mgedmin/example-project",
+        },
+        "builds": list(builds),
+    }
+
+
+def BuildHook(
+    id=380,
+    name='tests',
+    stage='test',
+    status='success',
+    duration=16.5,
+    artifacts_size=None,
+):
+    return {
+        "id": id,
+        "stage": stage,
+        "name": name,
+        "status": status,
+        "created_at": "2016-08-12 15:23:28 UTC",
+        "started_at": "2016-08-12 15:24:56 UTC",
+        "finished_at": "2016-08-12 15:25:26 UTC",
+        "duration": duration,
+        "queued_duration": 1.5,
+        "when": "on_success",
+        "manual": False,
+        "allow_failure": False,
+        "runner": {"id": 380987, "description": "shared-runners-manager-6"},
+        "artifacts_file": {
+            "filename": "artifacts.zip" if artifacts_size else None,
+            "size": artifacts_size,
+        },
+    }
+
+
+def JobHook(
+    id=1977,
+    pipeline_id=31,
+    name='tests',
+    status='success',
+    duration=17.5,
+):
+    return {
+        "object_kind": "build",
+        "ref": "master",
+        "build_id": id,
+        "build_name": name,
+        "build_stage": "test",
+        "build_status": status,
+        "build_created_at": "2021-02-23T02:41:37.886Z",
+        "build_started_at": "2021-02-23T02:41:40.886Z",
+        "build_finished_at": "2021-02-23T02:41:58.386Z",
+        "build_duration": duration,
+        "build_queued_duration": 3.0,
+        "pipeline_id": pipeline_id,
+        "project_id": 42,
+        "project_name": "mgedmin / example-project",
+        "runner": None,
+    }
+
+
+@pytest.mark.parametrize('timestamp, expected', [
+    ('2016-08-12 15:23:28 UTC', '2016-08-12T15:23:28Z'),
+    ('2021-02-23T02:41:37.886Z', '2021-02-23T02:41:37.886Z'),
+    (None, None),
+])
+def test_normalize_timestamp(timestamp, expected):
+    assert glj.normalize_timestamp(timestamp) == expected
+
+
+def test_record_from_webhook_pipeline():
+    payload = PipelineHook(builds=[BuildHook(artifacts_size=1024)])
+    assert glj.record_from_webhook('Pipeline Hook', payload) == {
+        'kind': 'pipeline',
+        'project_id': 42,
+        'project': 'mgedmin/example-project',
+        'project_name': 'example-project',
+        'id': 31,
+        'ref': 'master',
+        'sha': '632667547e7cd3e0466547863e1207a8c0c0c549',
+        'status': 'success',
+        'created_at': '2016-08-12T15:23:28Z',
+        'finished_at': '2016-08-12T15:26:29Z',
+        'duration': 63,
+        'user': {'name': 'Administrator', 'username': 'root'},
+        'jobs': [
+            {
+                'id': 380,
+                'name': 'tests',
+                'stage': 'test',
+                'status': 'success',
+                'created_at': '2016-08-12T15:23:28Z',
+                'started_at': '2016-08-12T15:24:56Z',
+                'finished_at': '2016-08-12T15:25:26Z',
+                'duration': 16.5,
+                'runner': {
+                    'id': 380987,
+                    'description': 'shared-runners-manager-6',
+                },
+                'artifacts': [
+                    {
+                        'file_type': 'archive',
+                        'size': 1024,
+                        'filename': 'artifacts.zip',
+                        'file_format': 'zip',
+                    },
+                ],
+            },
+        ],
+    }
+
+
+def test_record_from_webhook_job():
+    assert glj.record_from_webhook('Job Hook', JobHook()) == {
+        'kind': 'job',
+        'project_id': 42,
+        'pipeline_id': 31,
+        'id': 1977,
+        'name': 'tests',
+        'stage': 'test',
+        'status': 'success',
+        'created_at': '2021-02-23T02:41:37.886Z',
+        'started_at': '2021-02-23T02:41:40.886Z',
+        'finished_at': '2021-02-23T02:41:58.386Z',
+        'duration': 17.5,
+        'runner': None,
+        'artifacts': [],
+    }
+
+
+@pytest.mark.parametrize('event, payload', [
+    ('Pipeline Hook', PipelineHook(status='running')),
+    ('Job Hook', JobHook(status='running')),
+    ('Push Hook', {'object_kind': 'push'}),
+])
+def test_record_from_webhook_ignored(event, payload):
+    assert glj.record_from_webhook(event, payload) is None
+
+
+def test_store_load(tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    assert store.load() == []
+    store.append(glj.record_from_webhook('Job Hook', JobHook(
+        id=1977, pipeline_id=31, duration=20)))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=31, builds=[BuildHook(id=380), BuildHook(id=1977)])))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=32)))
+    with open(store.filename, 'a') as f:
+        f.write('\n')
+    store.append(glj.record_from_webhook('Job Hook', JobHook(
+        id=1977, pipeline_id=31, duration=30)))
+    pipelines = store.load()
+    assert [p['id'] for p in pipelines] == [32, 31]
+    assert [(j['id'], j['duration']) for j in pipelines[1]['jobs']] == [
+        (380, 16.5),
+        (1977, 30),
+    ]
+
+
+def test_stored_project(tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=31, builds=[BuildHook(id=380, status='failed')])))
+    project = glj.StoredProject(store, 'mgedmin/example-project')
+    assert project.id == 42
+    assert project.name == 'example-project'
+    [pipeline] = project.pipelines.list(page=1, per_page=20, ref='master')
+    assert pipeline.id == 31
+    assert pipeline.jobs.list(all=True, scope='success') == []
+    [job] = pipeline.jobs.list(all=True)
+    assert job.status == 'failed'
+    with pytest.raises(AttributeError):
+        job.no_such_attribute
+    assert project.pipelines.list(page=2, per_page=20) == []
+    assert project.pipelines.list(page=1, per_page=20, ref='foo') == []
+    assert project.pipelines.list(page=1, status='failed') == []
+    project = glj.StoredProject(store, 'mgedmin/other-project')
+    assert project.id is None
+    assert project.name == 'mgedmin/other-project'
+
+
+class FakeGitlabList(list):
+
+    total = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self:
+            raise StopIteration
+        return self.pop(0)
+
+
+@pytest.fixture
+def fast_gitlab(mock_gitlab):
+    gl = mock_gitlab.from_config.return_value
+    resources = {
+        '/projects/mgedmin%2Fexample-project': dict(
+            id=42, name='example-project',
+            path_with_namespace='mgedmin/example-project'),
+    }
+
+    def http_get(path, streamed=False, raw=False):
+        if streamed:
+            return Mock(iter_content=lambda chunk_size: [resources[path]])
+        return resources[path]
+
+    def http_list(path, query, get_all=False, iterator=False):
+        items = resources[path]
+        if iterator:
+            items = FakeGitlabList(items)
+            items.total = len(items)
+        return items
+
+    def set_pipelines(pipelines):
+        resources['/projects/42/pipelines'] = [
+            dict(id=pipeline.id, ref=pipeline.ref, sha=pipeline.sha,
+                 status=pipeline.status) for pipeline in pipelines
+        ]
+        for pipeline in pipelines:
+            path = '/projects/42/pipelines/{}'.format(pipeline.id)
+            resources[path] = pipeline.attributes
+            resources[path + '/jobs'] = [
+                job.attributes for job in pipeline.jobs.list.return_value
+            ]
+
+    gl.http_get = http_get
+    gl.http_list = http_list
+    gl.resources = resources
+    gl.set_pipelines = set_pipelines
+    return gl
+
+
+def test_fast_project(fast_gitlab):
+    fast_gitlab.set_pipelines([
+        Pipeline(id=2, jobs=[Job(id=21, runner_id=7)]),
+        Pipeline(id=1, user_name='Bob', jobs=[]),
+    ])
+    fast_gitlab.resources['/projects/42/jobs/21/trace'] = b'log'
+    project = glj.FastProject(fast_gitlab, 'mgedmin/example-project')
+    assert project.id == 42
+    assert project.name == 'example-project'
+    assert project.path_with_namespace == 'mgedmin/example-project'
+    [p2, p1] = project.pipelines.list(page=1, per_page=20)
+    assert p2.id == 2
+    assert p2.duration is None
+    listing = project.pipelines.list(iterator=True, per_page=20)
+    assert listing.total == 2
+    assert [p.id for p in listing] == [2, 1]
+    pipeline = project.pipelines.get(1)
+    assert pipeline.user == dict(name='Bob', username='mgedmin')
+    assert pipeline.attributes['duration'] == 38
+    [job] = project.pipelines.get(2).jobs.list(all=True, scope='success')
+    assert job.name == 'tests'
+    assert job.runner == dict(
+        id=7, description='shared-runners-manager-6.gitlb.com')
+    assert job.artifacts == [
+        dict(file_type='trace', size=2198, filename='job.log'),
+    ]
+    assert not hasattr(job, '__dict__')
+    trace = project.jobs.get(21, lazy=True).trace(streamed=True,
+                                                  iterator=True)
+    assert list(trace) == [b'log']
+
+
+def test_job_record_shares_runners():
+    job1 = glj.JobRecord(Job(id=1, runner_id=1234).attributes)
+    job2 = glj.JobRecord(Job(id=2, runner_id=1234).attributes)
+    assert job1.runner is job2.runner
+    assert job1.runner['id'] == 1234
+    assert job1.attributes['tag_list'] == []
+    job3 = glj.JobRecord(dict(Job(id=3).attributes, runner=None))
+    assert job3.runner is None
+
+
+def test_main_fast(set_argv, fast_gitlab, capsys):
+    fast_gitlab.set_pipelines([
+        Pipeline(id=2, jobs=[Job(id=21)]),
+    ])
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--fast',
+              '-v'])
+    glj.main()
+    assert fast_gitlab.session.mount.call_count == 2
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          2 (2020-04-29, commit da4b9237 by Marius, duration 0.6m)
+            tests                            0.3m
+
+        Summary:
+          tests    min  0.3m, max  0.3m, avg  0.3m, median  0.3m, stdev  0.0m
+          overall  min  0.6m, max  0.6m, avg  0.6m, median  0.6m, stdev  0.0m
+    ''')
+
+
+def test_main_store(set_argv, tmp_path, capsys):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=31, builds=[BuildHook(id=380)])))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=32, status='failed', builds=[BuildHook(id=390)])))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=33, ref='feature', builds=[BuildHook(id=400)])))
+    set_argv(['gitlab-jobs', '--store', store.filename, '-v'])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          31 (2016-08-12, commit 63266754 by Administrator, duration 1.1m)
+            tests                            0.3m
+
+        Summary:
+          tests    min  0.3m, max  0.3m, avg  0.3m, median  0.3m, stdev  0.0m
+          overall  min  1.1m, max  1.1m, avg  1.1m, median  1.1m, stdev  0.0m
+    ''')
+
+
+def test_main_store_sections(set_argv, tmp_path):
+    set_argv(['gitlab-jobs', '--store', str(tmp_path / 'store.jsonl'),
+              '--sections'])
+    with pytest.raises(SystemExit):
+        glj.main()
+
+
+def test_ingest_replay(set_argv, tmp_path, capsys):
+    store_file = tmp_path / 'store.jsonl'
+    (tmp_path / 'pipeline.json').write_text(json.dumps(PipelineHook()))
+    (tmp_path / 'job.json').write_text(json.dumps(JobHook()))
+    (tmp_path / 'running.json').write_text(json.dumps(JobHook(
+        status='running')))
+    set_argv(['gitlab-jobs', 'ingest', '--store', str(store_file),
+              '--replay', str(tmp_path / 'pipeline.json'),
+              str(tmp_path / 'job.json'), str(tmp_path / 'running.json')])
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(tmp_path), '/tmp')
+    assert stdout == textwrap.dedent('''\
+        Stored pipeline 31 from /tmp/pipeline.json
+        Stored job 1977 from /tmp/job.json
+        Skipping /tmp/running.json: not a finished pipeline or job
+    ''')
+    assert len(store_file.read_text().splitlines()) == 2
+
+
+def test_ingest_no_secret_token(set_argv, monkeypatch, tmp_path):
+    monkeypatch.delenv('GITLAB_WEBHOOK_TOKEN', raising=False)
+    set_argv(['gitlab-jobs', 'ingest', '--store', str(tmp_path / 'x')])
+    with pytest.raises(SystemExit):
+        glj.main()
+
+
+def test_ingest_bad_listen_address(set_argv, tmp_path):
+    set_argv(['gitlab-jobs', 'ingest', '--store', str(tmp_path / 'x'),
+              '--secret-token', 's3cr3t', '--listen', 'localhost:http'])
+    with pytest.raises(SystemExit):
+        glj.main()
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('8080', ('localhost', 8080)),
+    ('0.0.0.0:80', ('0.0.0.0', 80)),
+])
+def test_parse_listen_address(address, expected):
+    assert glj.parse_listen_address(address) == expected
+
+
+def test_ingest_serve(set_argv, monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv('GITLAB_WEBHOOK_TOKEN', 's3cr3t')
+    monkeypatch.setattr(glj.WebhookServer, 'serve_forever',
+                        Mock(side_effect=KeyboardInterrupt))
+    set_argv(['gitlab-jobs', 'ingest', '--store', str(tmp_path / 'x'),
+              '--listen', 'localhost:0'])
+    glj.main()
+    assert capsys.readouterr().out.startswith(
+        'Listening for GitLab webhooks on http://localhost:')
+
+
+@pytest.fixture
+def webhook_server(tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    server = glj.WebhookServer(('localhost', 0), store, 's3cr3t',
+                               verbose=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def post_webhook(server, event, body, token='s3cr3t'):
+    url = 'http://localhost:{}/'.format(server.server_address[1])
+    request = urllib.request.Request(url, data=body, headers={
+        'X-Gitlab-Event': event,
+        'X-Gitlab-Token': token,
+        'Content-Type': 'application/json',
+    })
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_webhook_server(webhook_server, capsys):
+    body = json.dumps(PipelineHook()).encode()
+    assert post_webhook(webhook_server, 'Pipeline Hook', body) == 200
+    body = json.dumps(JobHook(status='running')).encode()
+    assert post_webhook(webhook_server, 'Job Hook', body) == 200
+    [pipeline] = webhook_server.store.load()
+    assert pipeline['id'] == 31
+    assert '"POST / HTTP/1.1" 200' in capsys.readouterr().err
+
+
+def test_webhook_server_bad_token(webhook_server):
+    body = json.dumps(PipelineHook()).encode()
+    assert post_webhook(webhook_server, 'Pipeline Hook', body,
+                        token='guess') == 401
+    assert webhook_server.store.load() == []
+
+
+def test_webhook_server_malformed_payload(webhook_server):
+    assert post_webhook(webhook_server, 'Pipeline Hook', b'{}') == 400
+    assert post_webhook(webhook_server, 'Pipeline Hook', b'<xml>') == 400
+    assert webhook_server.store.load() == []
+
+
+@pytest.mark.parametrize('content_length, expected', [
+    (None, 400),
+    ('garbage', 400),
+    ('-1', 400),
+    (str(glj.MAX_WEBHOOK_PAYLOAD + 1), 413),
+])
+def test_webhook_server_bad_content_length(
+    webhook_server, content_length, expected,
+):
+    conn = http.client.HTTPConnection(
+        'localhost', webhook_server.server_address[1])
+    conn.putrequest('POST', '/')
+    conn.putheader('X-Gitlab-Event', 'Pipeline Hook')
+    conn.putheader('X-Gitlab-Token', 's3cr3t')
+    if content_length is not None:
+        conn.putheader('Content-Length', content_length)
+    conn.endheaders()
+    assert conn.getresponse().status == expected
+    conn.close()
+    assert webhook_server.store.load() == []
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('4', glj.RunnerGroup(4, frozenset(), 1.0)),
+    ('2:docker,gpu', glj.RunnerGroup(2, frozenset({'docker', 'gpu'}), 1.0)),
+    ('1@1.5', glj.RunnerGroup(1, frozenset(), 1.5)),
+    ('3:docker@0.5', glj.RunnerGroup(3, frozenset({'docker'}), 0.5)),
+])
+def test_parse_runner_spec(spec, expected):
+    assert glj.parse_runner_spec(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['', 'x', '0', '1@0', '1@fast'])
+def test_parse_runner_spec_errors(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        glj.parse_runner_spec(spec)
+
+
+def test_parse_split_spec():
+    assert glj.parse_split_spec('test=robot=4') == ('test=robot', 4)
+
+
+@pytest.mark.parametrize('spec', ['test_robot', '=4', 'test=0', 'test=x'])
+def test_parse_split_spec_errors(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        glj.parse_split_spec(spec)
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('deploy=build,tests', ('deploy', ['build', 'tests'])),
+    ('lint=', ('lint', [])),
+])
+def test_parse_needs_spec(spec, expected):
+    assert glj.parse_needs_spec(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['lint', '=build'])
+def test_parse_needs_spec_errors(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        glj.parse_needs_spec(spec)
+
+
+def test_parse_timestamp():
+    assert glj.parse_timestamp('2020-04-29T08:31:32.384Z') == 1588149092.384
+    assert glj.parse_timestamp('2020-04-29T11:31:32+03:00') == 1588149092
+
+
+def SimJob(name, stage, duration=60, tags=()):
+    return glj.SimJob(name, stage, duration, frozenset(tags))
+
+
+def test_build_job_graph():
+    jobs = [
+        SimJob('build', 'build'),
+        SimJob('lint', 'test'),
+        SimJob('tests', 'test', 120),
+        SimJob('deploy', 'deploy', tags=['prod']),
+    ]
+    assert glj.build_job_graph(jobs, {}, {}) == [
+        (60, frozenset(), []),
+        (60, frozenset(), [0]),
+        (120, frozenset(), [0]),
+        (60, frozenset({'prod'}), [0, 1, 2]),
+    ]
+    needs = {'lint': [], 'deploy': ['tests']}
+    assert glj.build_job_graph(jobs, needs, {'tests': 2}) == [
+        (60, frozenset(), []),
+        (60, frozenset(), []),
+        (60, frozenset(), [0]),
+        (60, frozenset(), [0]),
+        (60, frozenset({'prod'}), [2, 3]),
+    ]
+
+
+def test_run_simulation():
+    graph = glj.build_job_graph([
+        SimJob('build', 'build'),
+        SimJob('lint', 'test'),
+        SimJob('tests', 'test', 120),
+    ], {}, {})
+    runners = [glj.RunnerGroup(1, frozenset(), 1.0)]
+    # one runner: everything runs sequentially, the second pipeline waits
+    # for the first one
+    wall_times, queue_times = glj.run_simulation(
+        [graph, graph], [0, 60], runners)
+    assert wall_times == [300, 420]
+    assert queue_times == [0, 0, 60, 120, 180, 240]
+    # two runners, one of them twice as fast
+    runners = [
+        glj.RunnerGroup(1, frozenset(), 1.0),
+        glj.RunnerGroup(1, frozenset(), 2.0),
+    ]
+    wall_times, queue_times = glj.run_simulation([graph], [0], runners)
+    assert wall_times == [150]
+    assert queue_times == [0, 0, 0]
+
+
+def test_run_simulation_tags():
+    graph = glj.build_job_graph([
+        SimJob('tests', 'test', 60),
+        SimJob('gpu-tests', 'test', 60, tags=['gpu']),
+    ], {}, {})
+    runners = [
+        glj.RunnerGroup(2, frozenset(), 1.0),
+        glj.RunnerGroup(1, frozenset({'gpu'}), 1.0),
+    ]
+    wall_times, queue_times = glj.run_simulation(
+        [graph, graph], [0, 0], runners)
+    assert wall_times == [60, 120]
+    assert sorted(queue_times) == [0, 0, 0, 60]
+
+
+def test_run_simulation_empty_pipeline():
+    runners = [glj.RunnerGroup(1, frozenset(), 1.0)]
+    assert glj.run_simulation([[]], [0], runners) == ([0], [])
+
+
+def test_simulate(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project',
+              '--split', 'tests=2'])
+    set_pipelines([
+        Pipeline(id=2, duration=300, created_at='2020-04-29T09:00:00Z', jobs=[
+            Job(id=1003, name='build', stage='build', duration=60),
+            Job(id=1004, name='tests', stage='test', duration=240),
+            Job(id=1005, name='manual', stage='test', duration=None),
+        ]),
+        Pipeline(id=1, duration=300, created_at='2020-04-29T08:58:00Z', jobs=[
+            Job(id=1001, name='build', stage='build', duration=60),
+            Job(id=1002, name='tests', stage='test', duration=240),
+        ]),
+    ])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Loading last 20 successful pipelines of example-project master...
+
+        Runners:
+          1 x (untagged) @1
+
+        Simulated 2 pipelines:
+          recorded wall time    min  5.0m, median  5.0m, p95  5.0m, max  5.0m
+          simulated wall time   min  5.0m, median  6.5m, p95  7.8m, max  8.0m
+          simulated queue time  min  0.0m, median  1.0m, p95  2.8m, max  3.0m
+    ''')
+
+
+def test_simulate_arrival_rate(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project',
+              '--all-branches', '--arrival-rate', '60', '--runner', '2'])
+    set_pipelines([
+        Pipeline(id=i, jobs=[Job(id=i * 10, runner_id=i)])
+        for i in range(1, 4)
+    ])
+    glj.main()
+    assert capsys.readouterr().out.startswith(textwrap.dedent('''\
+        Loading last 20 successful pipelines of example-project...
+
+        Runners:
+          2 x (untagged) @1
+
+        Simulated 3 pipelines:
+    '''))
+
+
+def test_simulate_default_runners(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project'])
+    set_pipelines([
+        Pipeline(id=1, jobs=[
+            Job(id=1, runner_id=1),
+            Job(id=2, runner_id=2, tag_list=['docker']),
+            Job(id=3, runner_id=None, duration=None),
+        ]),
+    ])
+    glj.main()
+    assert '  2 x docker @1\n' in capsys.readouterr().out
+
+
+def test_simulate_no_suitable_runner(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project',
+              '--runner', '2:docker'])
+    set_pipelines([
+        Pipeline(id=1, jobs=[Job(id=1, tag_list=['gpu'])]),
+    ])
+    with pytest.raises(SystemExit):
+        glj.main()
+    assert 'no runner can run jobs with tags gpu' in capsys.readouterr().err
+
+
+def test_simulate_no_jobs(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project'])
+    set_pipelines([
+        Pipeline(id=1, duration=None),
+    ])
+    glj.main()
+    assert capsys.readouterr().out.endswith(textwrap.dedent('''\
+        Simulated 1 pipelines:
+          recorded wall time    n/a
+          simulated wall time   min  0.0m, median  0.0m, p95  0.0m, max  0.0m
+          simulated queue time  n/a
+    '''))
+
+
+def test_simulate_no_pipelines(set_argv, capsys):
+    set_argv(['gitlab-jobs', 'simulate', '-p', 'mgedmin/example-project'])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Loading last 20 successful pipelines of example-project master...
+
+        No pipelines found.
+    ''')
+
+
+def test_get_pipelines_date_range():
+    project = MagicMock()
+    args = glj.parser.parse_args(['--since', '2024-01-01',
+                                  '--until', '2024-02-01'])
+    list(glj.get_pipelines(project, args))
+    assert project.pipelines.list.call_args_list == [
+        call(page=1, per_page=20, ref='master', scope='finished',
+             status='success', updated_after='2024-01-01',
+             updated_before='2024-02-01'),
+    ]
+
+
+@pytest.mark.parametrize('total, n, expected', [
+    (5, 10, [0, 1, 2, 3, 4]),
+    (5, 1, [2]),
+    (10, 4, [0, 3, 6, 9]),
+    (1000, 3, [0, 500, 999]),
+])
+def test_even_sample_indices(total, n, expected):
+    assert glj.even_sample_indices(total, n) == expected
+
+
+def test_stratified_sample_indices():
+    pipelines = [
+        # newest first: 2 pipelines in week 2, 6 in week 1
+        Mock(created_at='2024-01-09T10:00:00Z'),
+        Mock(created_at='2024-01-08T10:00:00Z'),
+    ] + [
+        Mock(created_at='2024-01-0{}T10:00:00Z'.format(day))
+        for day in range(7, 1, -1)
+    ]
+    assert glj.stratified_sample_indices(pipelines, 4) == [0, 2, 4, 7]
+    assert glj.stratified_sample_indices(pipelines, 3) == [0, 2, 7]
+
+
+class RESTObjectList(list):
+
+    def __init__(self, items, total):
+        super().__init__(items)
+        self.total = total
+
+
+@pytest.fixture
+def set_pipeline_history(gitlab_project):
+    def set_pipeline_history(pipelines, total=-1):
+        def list_pipelines(iterator=False, page=1, per_page=20, **kw):
+            if iterator:
+                return RESTObjectList(
+                    pipelines, len(pipelines) if total == -1 else total)
+            return pipelines[(page - 1) * per_page:page * per_page]
+
+        gitlab_project.pipelines.list = Mock(side_effect=list_pipelines)
+        gitlab_project.pipelines.get = {
+            pipeline.id: pipeline for pipeline in pipelines
+        }.get
+
+    return set_pipeline_history
+
+
+def test_sample_pipelines(gitlab_project, set_pipeline_history):
+    set_pipeline_history([Pipeline(id=i) for i in range(400, 0, -1)])
+    args = glj.parser.parse_args(['--sample', '3'])
+    sample, total = glj.sample_pipelines(gitlab_project, args)
+    assert [pipeline.id for pipeline in sample] == [400, 200, 1]
+    assert total == 400
+    assert gitlab_project.pipelines.list.call_args_list == [
+        call(iterator=True, per_page=100, ref='master', scope='finished',
+             status='success'),
+        call(page=3, per_page=100, ref='master', scope='finished',
+             status='success'),
+        call(page=4, per_page=100, ref='master', scope='finished',
+             status='success'),
+    ]
+
+
+def test_sample_pipelines_list_shrank(gitlab_project, set_pipeline_history):
+    # some pipelines got deleted after we asked for the total count
+    set_pipeline_history([Pipeline(id=i) for i in range(200, 50, -1)],
+                         total=200)
+    args = glj.parser.parse_args(['--sample', '2'])
+    sample, total = glj.sample_pipelines(gitlab_project, args)
+    assert [pipeline.id for pipeline in sample] == [200]
+    assert total == 200
+
+
+def test_sample_pipelines_total_unknown(gitlab_project, set_pipeline_history):
+    set_pipeline_history([Pipeline(id=i) for i in range(10, 0, -1)],
+                         total=None)
+    args = glj.parser.parse_args(['--sample', '2'])
+    sample, total = glj.sample_pipelines(gitlab_project, args)
+    assert [pipeline.id for pipeline in sample] == [10, 1]
+    assert total == 10
+
+
+def test_sample_pipelines_by_week(gitlab_project, set_pipeline_history):
+    set_pipeline_history([
+        Pipeline(id=3, created_at='2024-01-08T10:00:00Z'),
+        Pipeline(id=2, created_at='2024-01-07T10:00:00Z'),
+        Pipeline(id=1, created_at='2024-01-06T10:00:00Z'),
+    ])
+    args = glj.parser.parse_args(['--sample', '2', '--sample-by', 'week'])
+    sample, total = glj.sample_pipelines(gitlab_project, args)
+    assert [pipeline.id for pipeline in sample] == [3, 2]
+    assert total == 3
+
+
+@pytest.mark.parametrize('values, population, expected', [
+    ([1, 2, 3], 3, 0),
+    ([1], 10, math.inf),
+    ([1, 2, 3], 10**9, 1.1316),
+    ([1, 2, 3], 5, 0.8002),
+])
+def test_confidence_interval(values, population, expected):
+    assert glj.confidence_interval(values, population) == pytest.approx(
+        expected, abs=1e-4)
+
+
+def test_main_sample(
+    set_argv, set_pipeline_history, set_git_remote_url, capsys,
+):
+    set_argv(['gitlab-jobs', '--sample', '2'])
+    set_git_remote_url('https://gitlab.com/mgedmin/example-project')
+    set_pipeline_history([
+        Pipeline(id=i, duration=60 * i, jobs=[Job(id=i, duration=30 * i)])
+        for i in range(5, 0, -1)
+    ])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Determined the GitLab project to be mgedmin/example-project
+        2 of 5 successful pipelines of example-project master,\
+ sampled evenly:
+          5 (2020-04-29, commit ac3478d6, duration 5.0m)
+          1 (2020-04-29, commit 356a192b, duration 1.0m)
+
+        Summary:
+          tests    min  0.5m, max  2.5m, avg  1.5m, median  1.5m,\
+ stdev  1.4m, avg 95% CI ±1.7m
+          overall  min  1.0m, max  5.0m, avg  3.0m, median  3.0m,\
+ stdev  2.8m, avg 95% CI ±3.4m
+    ''')
+
+
+def test_main_sample_by_week_all_branches(
+    set_argv, set_pipeline_history, capsys,
+):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--sample', '1',
+              '--sample-by', 'week', '--all-branches'])
+    set_pipeline_history([Pipeline(id=1)])
+    glj.main()
+    assert capsys.readouterr().out.startswith(
+        '1 of 1 successful pipelines of example-project, sampled every week:')
+
+
+@pytest.mark.parametrize('argv', [
+    ['--sample', '0'],
+    ['--sample', '10', '--compare', 'master', 'feature'],
+    ['--sample', '10', '--append-csv', 'jobs.csv'],
+])
+def test_main_sample_errors(set_argv, argv):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project'] + argv)
+    with pytest.raises(SystemExit):
+        glj.main()
+
+
+def test_stored_project_date_range(tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=31)))
+    project = glj.StoredProject(store)
+    listing = project.pipelines.list(
+        iterator=True, updated_after='2016-08-12', updated_before='2016-08-13')
+    assert [pipeline.id for pipeline in listing] == [31]
+    assert listing.total == 1
+    assert project.pipelines.list(updated_after='2016-08-13') == []
+    assert project.pipelines.list(updated_before='2016-08-12') == []
+
+
+def test_stored_project_by_update_time(tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    for id, finished_at in [(31, '2016-08-12T14:00:00Z'),
+                            (32, '2016-08-12T13:00:00Z')]:
+        record = glj.record_from_webhook('Pipeline Hook', PipelineHook(id=id))
+        record['finished_at'] = finished_at
+        store.append(record)
+    project = glj.StoredProject(store)
+    listing = project.pipelines.list(
+        iterator=True, order_by='updated_at', sort='desc')
+    assert [pipeline.id for pipeline in listing] == [31, 32]
+    assert listing[0].updated_at == '2016-08-12T14:00:00Z'
+
+
+def test_main_jsonl_export(
+    set_argv, set_pipelines, gitlab_project, capsys, tmp_path,
+):
+    gitlab_project.path_with_namespace = 'mgedmin/example-project'
+    jobs_jsonl = tmp_path / 'jobs.jsonl'
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--jsonl', str(jobs_jsonl)])
+    set_pipelines([
+        Pipeline(id=1, jobs=[
+            Job(id=1002, name='tests', tag_list=['docker']),
+            Job(id=1001, name='build', stage='build'),
+        ]),
+    ])
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_jsonl), '/tmp/j.jsonl')
+    assert stdout.endswith('\nWriting /tmp/j.jsonl...\n')
+    [record] = map(json.loads, jobs_jsonl.read_text().splitlines())
+    assert record['id'] == 1
+    assert record['project'] == 'mgedmin/example-project'
+    assert record['user'] == {'name': 'Marius', 'username': 'mgedmin'}
+    assert [job['name'] for job in record['jobs']] == ['build', 'tests']
+    assert record['jobs'][1]['started_at'] == '2020-04-29T08:31:48.821Z'
+    assert record['jobs'][1]['runner']['id'] == 380987
+    assert record['jobs'][1]['tag_list'] == ['docker']
+    # the export can be used as a --store
+    set_argv(['gitlab-jobs', '--store', str(jobs_jsonl)])
+    glj.main()
+    assert 'tests    min  0.3m' in capsys.readouterr().out
+
+
+def test_main_jsonl_export_from_store(set_argv, tmp_path):
+    store = glj.Store(str(tmp_path / 'store.jsonl'))
+    store.append(glj.record_from_webhook('Pipeline Hook', PipelineHook(
+        id=31, builds=[BuildHook(id=380)])))
+    jobs_jsonl = tmp_path / 'jobs.jsonl'
+    set_argv(['gitlab-jobs', '--store', store.filename,
+              '--jsonl', str(jobs_jsonl)])
+    glj.main()
+    [record] = map(json.loads, jobs_jsonl.read_text().splitlines())
+    assert record['project'] == 'mgedmin/example-project'
+    assert record['jobs'][0]['tag_list'] == []
+
+
+def test_write_jsonl_replaces_the_file(tmp_path):
+    jobs_jsonl = tmp_path / 'jobs.jsonl'
+    jobs_jsonl.write_text('{"kind": "pipeline", "id": 1}\n')
+    inode = jobs_jsonl.stat().st_ino
+    glj.write_jsonl(str(jobs_jsonl), [{'kind': 'pipeline', 'id': 2}])
+    assert jobs_jsonl.read_text() == '{"kind": "pipeline", "id": 2}\n'
+    assert jobs_jsonl.stat().st_ino != inode
+    assert [f.name for f in tmp_path.iterdir()] == ['jobs.jsonl']
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    clock = Mock(now=0)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(glj, 'time', clock)
+    return clock
+
+
+def test_main_max_time(
+    set_argv, set_pipelines, fake_clock, capsys, tmp_path,
+):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--max-time', '60', '--sections', '--append-csv',
+              str(jobs_csv)])
+    slow = Pipeline(id=2, jobs=[Job(id=1002)])
+    slow.jobs.list.side_effect = lambda **kw: (
+        setattr(fake_clock, 'now', 61) or [Job(id=1002)])
+    set_pipelines([
+        Pipeline(id=3, jobs=[Job(id=1003)]),
+        slow,
+        Pipeline(id=1, jobs=[Job(id=1001)]),
+    ])
+    glj.main()
+    stdout = capsys.readouterr().out.replace(str(jobs_csv), '/tmp/jobs.csv')
+    assert stdout == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          3 (2020-04-29, commit 77de68da, duration 0.6m)
+          2 (2020-04-29, commit da4b9237, duration 0.6m)
+
+        Partial summary of 2 pipelines (time limit reached):
+          tests    min  0.3m, max  0.3m, avg  0.3m, median  0.3m, stdev  0.0m
+          overall  min  0.6m, max  0.6m, avg  0.6m, median  0.6m, stdev  0.0m
+
+        Skipping sections: time limit reached.
+
+        Not updating /tmp/jobs.csv: the results are partial.
+    ''')
+    assert not jobs_csv.exists()
+
+
+def test_main_interrupted(set_argv, set_pipelines, capsys, tmp_path):
+    jobs_csv = tmp_path / "jobs.csv"
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--append-csv', str(jobs_csv)])
+    interrupted = Pipeline(id=2, duration=None)
+    interrupted.jobs.list.side_effect = KeyboardInterrupt
+    set_pipelines([
+        interrupted,
+        Pipeline(id=1),
+    ])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          2 (2020-04-29, commit da4b9237)
+
+        No finished pipelines found (interrupted).
+    ''')
+    assert not jobs_csv.exists()
+
+
+def test_main_summary_every(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--summary-every', '2'])
+    set_pipelines([
+        Pipeline(id=3, duration=60),
+        Pipeline(id=2, duration=None),
+        Pipeline(id=1, duration=120),
+    ])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          3 (2020-04-29, commit 77de68da, duration 1.0m)
+          2 (2020-04-29, commit da4b9237)
+
+        Interim summary of 2 pipelines:
+          overall  min  1.0m, max  1.0m, avg  1.0m, median  1.0m, stdev  0.0m
+
+          1 (2020-04-29, commit 356a192b, duration 2.0m)
+
+        Summary:
+          overall  min  1.0m, max  2.0m, avg  1.5m, median  1.5m, stdev  0.7m
+    ''')
+
+
+def test_main_summary_every_bad_value(set_argv):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project',
+              '--summary-every', '0'])
+    with pytest.raises(SystemExit):
+        glj.main()
+
+
+def test_main_progress(
+    set_argv, gitlab_project, mock_gitlab, fake_clock, capsys,
+):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--progress',
+              '-l', '4'])
+    hooks = mock_gitlab.from_config.return_value.session.hooks['response']
+    pipelines = {
+        2: Pipeline(id=2),
+        1: Pipeline(id=1),
+    }
+
+    def get(id):
+        # pretend each pipeline takes a second and two HTTP requests
+        [count_request] = hooks.append.call_args[0]
+        fake_clock.now += 1
+        count_request(Mock())
+        count_request(Mock())
+        return pipelines[id]
+
+    gitlab_project.pipelines.list.return_value = list(pipelines.values())
+    gitlab_project.pipelines.get = get
+    glj.main()
+    # colorama strips the ANSI erase-line codes
+    assert capsys.readouterr().err.split('\r') == [
+        '',
+        '',
+        '1/4 pipelines, 1.0 pipelines/s, 2.0 requests/s, ETA 3s',
+        '',
+        '2/4 pipelines, 1.0 pipelines/s, 2.0 requests/s, ETA 2s',
+        '',
+    ]
+    assert hooks.append.call_count == 1
+
+
+def test_split_retried():
+    jobs = [
+        Job(id=12, name='tests'),
+        Job(id=11, name='lint'),
+        Job(id=10, name='tests', status='failed'),
+    ]
+    latest, retried = glj.split_retried(jobs)
+    assert [job.id for job in latest] == [12, 11]
+    assert [job.id for job in retried] == [10]
+
+
+def test_main_cost(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--cost'])
+    pipeline = Pipeline(id=1, jobs=[
+        Job(id=13, name='deploy', stage='deploy', status='manual',
+            duration=None),
+        Job(id=12, name='lint', stage='lint', status='canceled',
+            duration=30),
+        Job(id=11, name='tests', duration=120),
+        Job(id=10, name='tests', status='failed', duration=60),
+    ])
+    set_pipelines([pipeline])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+        Last 20 successful pipelines of example-project master:
+          1 (2020-04-29, commit 356a192b, duration 0.6m)
+
+        Summary:
+          tests    min  2.0m, max  2.0m, avg  2.0m, median  2.0m, stdev  0.0m
+          overall  min  0.6m, max  0.6m, avg  0.6m, median  0.6m, stdev  0.0m
+
+        Runner minutes by job, including failed and retried attempts:
+          job       total  success  failed  canceled  retried  wasted
+          lint        0.5      0.0     0.0       0.5      0.0    100%
+          tests       3.0      2.0     0.0       0.0      1.0     33%
+
+        Runner minutes by stage:
+          stage     total  success  failed  canceled  retried  wasted
+          lint        0.5      0.0     0.0       0.5      0.0    100%
+          test        3.0      2.0     0.0       0.0      1.0     33%
+          overall     3.5      2.0     0.0       0.5      1.0     43%
+    ''')
+    pipeline.jobs.list.assert_called_once_with(all=True, include_retried=True)
+
+
+def Archive(size, file_type='archive'):
+    return dict(file_type=file_type, size=size, filename='artifacts.zip',
+                file_format='zip')
+
+
+def test_artifact_size():
+    job = Job(id=1, artifacts=[Archive(1000), Archive(20, 'junit')])
+    assert glj.artifact_size(job) == 1020
+    assert glj.artifact_size(job, glj.DOWNLOADED_ARTIFACTS) == 1000
+
+
+def test_last_stage():
+    assert glj.last_stage([]) is None
+    assert glj.last_stage([
+        Job(id=5, stage='test'),
+        Job(id=3, stage='test'),
+        Job(id=4, stage='deploy'),
+        Job(id=2, stage='build'),
+    ]) == 'deploy'
+
+
+@pytest.mark.parametrize('values, expected', [
+    ([], None),
+    ([5], None),
+    ([3, 2, 1], 2.0),
+    ([3, 0], None),
+])
+def test_growth(values, expected):
+    assert glj.growth(values) == expected
+
+
+@pytest.mark.parametrize('size, expected', [
+    (0, '0.0 B'),
+    (1536, '1.5 KiB'),
+    (3 * 1024 ** 2, '3.0 MiB'),
+    (5 * 1024 ** 4, '5120.0 GiB'),
+])
+def test_fmt_size(size, expected):
+    assert glj.fmt_size(size) == expected
+
+
+def test_main_artifacts(set_argv, set_pipelines, capsys):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--artifacts'])
+    MiB = 1024 ** 2
+    set_pipelines([
+        Pipeline(id=n, jobs=[
+            Job(id=n * 10 + 1, name='build', stage='build', duration=n * 10,
+                artifacts=[Archive(n * MiB)]),
+            Job(id=n * 10 + 2, name='deploy', stage='deploy',
+                artifacts=[Archive(2 * MiB), Archive(MiB, 'junit')]),
+            Job(id=n * 10 + 3, name='manual', stage='deploy', duration=None),
+            Job(id=n * 10 + 4, name='docs', stage='build',
+                artifacts=[Archive((n + 1) // 2 * MiB + MiB)]),
+            Job(id=n * 10 + 5, name='lint', stage='build',
+                artifacts=[Archive((n + 1) // 2 * 5 * 1024 + 95 * 1024)]),
+        ])
+        for n in [4, 3, 2, 1]
+    ])
+    glj.main()
+    stdout = capsys.readouterr().out
+    assert stdout[stdout.index('Artifacts'):] == textwrap.dedent('''\
+        Artifacts, not counting job logs:
+          job       avg size   max size  growth  r(duration)
+          build      2.5 MiB    4.0 MiB   +133%        +1.00
+          deploy     3.0 MiB    3.0 MiB     +0%          n/a
+          docs       2.5 MiB    3.0 MiB    +50%          n/a
+          lint     102.5 KiB  105.0 KiB     +5%          n/a
+          overall    8.1 MiB   10.1 MiB    +46%          n/a
+
+        Grew the most:
+          build    +133%, from 1.5 MiB to 3.5 MiB
+          docs     +50%, from 2.0 MiB to 3.0 MiB
+
+        Large artifacts from the last stage, which no later job can download:
+          deploy   avg 2.0 MiB
+    ''')
+
+
+def test_get_new_pipelines_time_limit(gitlab_project, fake_clock):
+    gitlab_project.pipelines.list.return_value = [Pipeline(id=2)]
+    args = glj.parser.parse_args([])
+    args.deadline = 0
+    with pytest.raises(glj.TimeLimitReached):
+        glj.get_new_pipelines(gitlab_project, args, {1}, None)
+
+
+def test_sample_pipelines_time_limit(
+    gitlab_project, set_pipeline_history, fake_clock,
+):
+    set_pipeline_history([Pipeline(id=i) for i in range(400, 0, -1)])
+    args = glj.parser.parse_args(['--sample', '3'])
+    args.deadline = 0
+    with pytest.raises(glj.TimeLimitReached):
+        glj.sample_pipelines(gitlab_project, args)
+
+
+def test_main_sample_time_limit(
+    set_argv, set_pipeline_history, fake_clock, capsys,
+):
+    set_pipeline_history([Pipeline(id=i) for i in range(10, 0, -1)])
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--sample',
+              '2', '--sample-by', 'week', '--max-time', '0'])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+
+        No finished pipelines found (time limit reached).
+    ''')
+
+
+def test_main_sample_interrupted(set_argv, gitlab_project, capsys):
+    gitlab_project.pipelines.list.side_effect = KeyboardInterrupt
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--sample',
+              '2'])
+    glj.main()
+    assert capsys.readouterr().out == textwrap.dedent('''\
+
+        No finished pipelines found (interrupted).
+    ''')
+
+
+def test_main_sections_time_limit(
+    set_argv, set_pipelines, fake_clock, capsys, tmp_path,
+):
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--sections',
+              '--max-time', '60', '--cache-dir', str(tmp_path)])
+    pipeline = Pipeline(id=1)
+    pipeline.jobs.list.side_effect = lambda **kw: (
+        setattr(fake_clock, 'now', 61) or [Job(id=1001), Job(id=1002)])
+    set_pipelines([pipeline])
+    glj.main()
+    assert capsys.readouterr().out.endswith(textwrap.dedent('''\
+
+        Sections, partial (time limit reached, skipped 2 of 2 job logs):
+    '''))
+
+
+def test_main_compare_time_limit(set_argv, gitlab_project, fake_clock, capsys):
+    gitlab_project.pipelines.list.return_value = [Pipeline(id=1)]
+    set_argv(['gitlab-jobs', '-p', 'mgedmin/example-project', '--compare',
+              'master', 'feature', '--max-time', '0'])
+    glj.main()
+    assert capsys.readouterr().out.splitlines() == [
+        'Comparing last 20 successful pipelines of example-project master'
+        ' and feature:',
+        '',
+        'Time limit reached, comparing only the pipelines fetched so far'
+        ' (0 and 0).',
+        '',
+    ]